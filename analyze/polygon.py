@@ -1,8 +1,13 @@
+import os
 import sys
 
 import numpy as np
 from matplotlib import patches, collections, ticker, pyplot as plt
-from skimage import io, morphology, measure
+from skimage import morphology, measure
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from missions import load_mission
+from raster import rasterize, encode_png
 
 # width of vacuum opening
 ROOMBA_WIDTH = 180
@@ -151,63 +156,20 @@ def Rotate2D(points, center, angle=np.pi/4):
     return np.dot(points - center, np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]]))+center
 
 def renderArea(filename):
-    npzfile = np.load(filename)
-
-    points = npzfile["points"][:] * 11.8  # convert to mm
-    values = npzfile["values"][:]
-
-    minx=np.amin(points, axis=0)[0]
-    maxx=np.amax(points, axis=0)[0]
-
-    miny=np.amin(points, axis=0)[1]
-    maxy=np.amax(points, axis=0)[1]
-
-    print(minx, maxx, miny, maxy)
-
-    #fig, ax = plt.subplots()
-    fig = plt.figure(figsize=((maxx-minx+300)/100/SCALING_FACTOR,(maxy-miny+300)/100/SCALING_FACTOR), dpi=100)
-    ax = plt.Axes(fig, [0., 0., 1., 1.])
-    ax.set_axis_off()
-    fig.add_axes(ax)    
-
-    # size and fixed aspect ratio
-    #fig.set_size_inches(10, 8)
-    ax.set_aspect('equal')
-
-    ax.set_xlim(minx-150, maxx+150)
-    ax.set_ylim(miny-150, maxy+150)
-
-    # set background colors
-    fig.patch.set_facecolor('black')
-    #ax.set_facecolor('black')
-
-    # all off
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-
-    plt.tick_params(top=False, bottom=False, left=False, right=False, labelleft=False, labelbottom=False)
-
-    # call this before any transformations. reason is unknown
-    fig.canvas.draw()   
+    """ returns the area covered by the path as image (row 0 = top), SCALING_FACTOR mm per pixel; also saved as png """
+    points = load_mission(filename).points()  # in mm
 
-    # plot robot path with respect to width of vacuum unit (e.g. 180mm)
-    # from https://stackoverflow.com/questions/19394505/matplotlib-expand-the-line-with-specified-width-in-data-unit#42972469 
-    # if you want to updated lines (e.g. resize plot) take the full code from that answer
-    lw = ((ax.transData.transform((1, ROOMBA_WIDTH))-ax.transData.transform((0, 0)))*(72./fig.dpi))[1]
-    plt.plot(points[:,0], points[:,1], '-', color="white", linewidth=lw, alpha=1.)
+    # path with respect to width of vacuum unit (e.g. 180mm)
+    area = rasterize(points, scale=SCALING_FACTOR, width=ROOMBA_WIDTH, margin=150).grid
 
-    #buffer = io.BytesIO()
-    plt.savefig(sys.argv[1]+".png", format="png", dpi=100, facecolor=fig.get_facecolor(), edgecolor='none')     # save as file (800x600)
-    plt.close('all')  
-    #return buffer   
+    with open(filename+".png", "wb") as f:
+        f.write(encode_png(area))
+    return area.astype(np.float64)
 
 
 # load test data
 if len(sys.argv) > 1:
-    renderArea(sys.argv[1])
-    source = io.imread(sys.argv[1]+".png", as_gray=True)
+    source = renderArea(sys.argv[1])
     #source = morphology.convex_hull_image(source)
 
     fig, axes = plt.subplots(nrows=3, ncols=4, figsize=(9.3, 6), sharex=True, sharey=True)
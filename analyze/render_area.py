@@ -1,112 +1,81 @@
-import sys
-import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-
-class data_linewidth_plot():
-    """ from https://stackoverflow.com/questions/19394505/matplotlib-expand-the-line-with-specified-width-in-data-unit#42972469 """
-    def __init__(self, x, y, **kwargs):
-        self.ax = kwargs.pop("ax", plt.gca())
-        self.fig = self.ax.get_figure()
-        self.lw_data = kwargs.pop("linewidth", 1)
-        self.lw = 1
-        self.fig.canvas.draw()
-        self.timer = None
-        self.saved = False
-
-        self.ppd = 72./self.fig.dpi
-        self.trans = self.ax.transData.transform
-        self.linehandle, = self.ax.plot([],[],**kwargs)
-        if "label" in kwargs: kwargs.pop("label")
-        self.line, = self.ax.plot(x, y, **kwargs)
-        self.line.set_color(self.linehandle.get_color())
-        self._resize()
-        self.cid = self.fig.canvas.mpl_connect('draw_event', self._resize)
-
-    def _resize(self, event=None):
-        lw =  ((self.trans((1, self.lw_data))-self.trans((0, 0)))*self.ppd)[1]
-        if lw != self.lw:
-            self.line.set_linewidth(lw)
-            self.lw = lw
-            self._redraw_later()
-
-    def _callback(self):
-        #print(self.lw)
-        self.fig.canvas.draw_idle()
-        if not self.saved:
-            plt.savefig(sys.argv[1]+".png", format="png", dpi=1000, facecolor=fig.get_facecolor(), edgecolor='none')     # save as file (800x600)
-            self.saved = True
-
-    def _redraw_later(self):
-        """ this is some strange workaround for updating the figure """
-        if not self.timer:
-            self.timer = self.fig.canvas.new_timer(interval=2000)
-            self.timer.single_shot = False
-            self.timer.add_callback(self._callback)
-            self.timer.start()
-
-if len(sys.argv) > 1:
-    npzfile = np.load(sys.argv[1])
-
-    points = npzfile["points"][:] * 11.8  # convert to mm
-    values = npzfile["values"][:]
-
-    minx=np.amin(points, axis=0)[0]
-    maxx=np.amax(points, axis=0)[0]
-
-    miny=np.amin(points, axis=0)[1]
-    maxy=np.amax(points, axis=0)[1]
-
-#    ax.set_ylim(ax.get_ylim()[0]-150, ax.get_ylim()[1]+150)
-#    ax.set_xlim(ax.get_xlim()[0]-150, ax.get_xlim()[1]+150)
-
-    #plt.imshow(raw.T, origin='lower', extent=(minx,maxx,miny,maxy))
-
-
-    # plot a line, with 'linewidth' in (y-)data coordinates.       
-    fig, ax = plt.subplots()
-    #ax.set_title(u"Floor map", fontsize=20)
-
-    #plt.subplots_adjust(left=0.05, right=0.95, top=0.95, bottom=0.05)
-
-    # fixed aspect ratio
-    ax.set_aspect('equal')
-    fig.set_size_inches((maxx-minx)/1000, (maxy-miny)/1000)
-    
-
-    ax.set_xlim(minx-150, maxx+150)
-    ax.set_ylim(miny-150, maxy+150)
-
-    # set background colors
-    fig.patch.set_facecolor('black')
-    ax.set_facecolor('black')
-
-    # setup grid
-    #ax.grid(which="both", linestyle="dotted", linewidth=1, alpha=.5, zorder=5)
-    ax.xaxis.set_major_locator(matplotlib.ticker.MultipleLocator(500))
-    ax.yaxis.set_major_locator(matplotlib.ticker.MultipleLocator(500))
-
-    #ax.xaxis.set_minor_locator(matplotlib.ticker.MultipleLocator(500))
-    #ax.yaxis.set_minor_locator(matplotlib.ticker.MultipleLocator(500))
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
 
+""" Render the area covered by a mission: white path of the cleaning width on black, at an exact scale.
 
-    ax.xaxis.set_ticklabels([])
-    ax.yaxis.set_ticklabels([])
+    python3 render_area.py 2018-08-05_191829_path.npz
+    python3 render_area.py /data/roomba/*_path.npz --scale 2 --output-dir /data/areas
 
-    #ax.axis('off')
+The image is rendered headless (Agg) and written right away. Its size follows from the extent of the path and the
+scale, so every pixel is exactly scale x scale mm and the stroke width is computed once from the scale.
+"""
 
-    #ax.tick_params(axis='x', colors='white')
-    #ax.tick_params(axis='y', colors='white')
-
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-    ax.spines['left'].set_visible(False)
+import os
+import sys
+import argparse
 
-    plt.tick_params(top=False, bottom=False, left=False, right=False, labelleft=False, labelbottom=False)
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from missions import load_mission, find_missions
+from raster import encode_png
+
+# width of the rendered path (vacuum opening plus brushes)
+AREA_WIDTH = 200
+MARGIN = 150
+DPI = 100
+
+
+def render_area(points, scale=1., width=AREA_WIDTH, margin=MARGIN):
+    """returns a uint8 image (rows, cols) of the path (points in mm) with the given width [mm],
+    at scale [mm/pixel]; row 0 is the top (largest y)"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    low = np.amin(points, axis=0) - margin
+    high = np.amax(points, axis=0) + margin
+
+    # whole pixels; the extent is grown to match them, so the scale is exact
+    cols, rows = np.ceil((high - low) / scale).astype(int)
+    high = low + np.array([cols, rows]) * scale
+
+    fig = Figure(figsize=(cols / DPI, rows / DPI), dpi=DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0., 0., 1., 1.])
+    ax.set_axis_off()
+    ax.set_xlim(low[0], high[0])
+    ax.set_ylim(low[1], high[1])
+    fig.patch.set_facecolor('black')
 
-    # plot robot path with respect to width of vacuum unit (180mm)
-    data_linewidth_plot(points[:,0], points[:,1], ax=ax, linewidth=200, alpha=1, color="white", solid_capstyle="round")
-    
-    fig.tight_layout()
-    plt.show()                        
+    # path width in points: width / scale pixels at DPI pixels per 72 points
+    lw = width / scale * 72. / DPI
+    ax.plot(points[:,0], points[:,1], '-', linewidth=lw, color="white", solid_capstyle="round", solid_joinstyle="round")
+
+    fig.canvas.draw()
+    image = np.asarray(fig.canvas.buffer_rgba())
+    return image[:rows, :cols, 0].copy()
+
+
+def save_area(filename, output=None, scale=1., width=AREA_WIDTH, margin=MARGIN):
+    """renders the area of a mission into output (default: <mission>.png) and returns its name"""
+    output = output or filename + ".png"
+    image = render_area(load_mission(filename).points(), scale, width, margin)
+    with open(output, "wb") as f:
+        f.write(encode_png(image))
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="render the area covered by roomba missions")
+    parser.add_argument("paths", nargs="+", help="mission files, directories or glob patterns")
+    parser.add_argument("--scale", type=float, default=1., help="mm per pixel")
+    parser.add_argument("--width", type=float, default=AREA_WIDTH, help="path width in mm")
+    parser.add_argument("--margin", type=float, default=MARGIN, help="border around the path in mm")
+    parser.add_argument("--output-dir", help="write the images here instead of next to the missions")
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for filename in find_missions(args.paths):
+        output = os.path.join(args.output_dir, os.path.basename(filename) + ".png") if args.output_dir else None
+        print(save_area(filename, output, args.scale, args.width, args.margin))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import functools
+
+import paho.mqtt.client as mqtt
+
+from bridge import RoombaBridge
+
+
+class AsyncioHelper(object):
+    """ Drive the network loop of a paho client from an asyncio event loop instead of a background thread.
+    Taken from the paho-mqtt examples (loop_asyncio.py)
+    The socket callbacks may also run on another thread (connect() runs in an executor, see keep_connected()); they
+    are then handed over to the event loop.
+    """
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        # set while paho has no output waiting for the socket to become writable
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.client.on_socket_open = self.in_loop(self.on_socket_open)
+        self.client.on_socket_close = self.in_loop(self.on_socket_close)
+        self.client.on_socket_register_write = self.in_loop(self.on_socket_register_write)
+        self.client.on_socket_unregister_write = self.in_loop(self.on_socket_unregister_write)
+
+    def in_loop(self, callback):
+        """returns a wrapper that runs callback in the event loop"""
+        def wrapper(*args):
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is self.loop:
+                callback(*args)
+            else:
+                self.loop.call_soon_threadsafe(callback, *args)
+        return wrapper
+
+    def on_socket_open(self, client, userdata, sock):
+        def read():
+            client.loop_read()
+            # a TLS socket (roomba) may hold already decrypted data that does not wake up the event loop again
+            while getattr(sock, "pending", lambda: 0)() and client.loop_read() == mqtt.MQTT_ERR_SUCCESS:
+                pass
+        self.loop.add_reader(sock, read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        # nothing will be written anymore, don't keep anyone waiting
+        self.drained.set()
+        if self.misc:
+            self.misc.cancel()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.drained.clear()
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+        self.drained.set()
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+
+class BoundedQueue(object):
+    """ asyncio queue with an explicit overflow policy
+        drop_oldest: discard the oldest queued message to make room for the new one
+        drop_newest: discard the new message
+    """
+    def __init__(self, size, overflow="drop_oldest"):
+        if overflow not in ["drop_oldest", "drop_newest"]:
+            raise ValueError("unknown overflow policy '{}'".format(overflow))
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflow = overflow
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, item):
+        """never blocks, drops a message instead if the queue is full"""
+        if self.queue.full():
+            self.dropped += 1
+            if self.overflow == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def get(self):
+        return await self.queue.get()
+
+    def depth(self):
+        return self.queue.qsize()
+
+
+def pending_output(client):
+    """returns the number of packets paho holds until the socket becomes writable (there is no public api for that)"""
+    return len(client._out_packet)
+
+
+class AsyncRoombaBridge(RoombaBridge):
+    """ Same as RoombaBridge but runs all mqtt clients in a single asyncio event loop.
+    Received messages are only queued in the network callbacks. Decoding and forwarding is done by one worker task per direction,
+    so a slow upstream broker never stalls reading from the roomba (and vice versa).
+    paho buffers published messages without limit, so the upstream worker waits while more than "max_pending" packets
+    are not written to the upstream socket yet. A slow upstream broker then fills the bounded queue and its overflow
+    policy applies.
+    """
+    def __init__(self, settings):
+        config = settings.get("asyncio", {})
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+        self.to_upstream = BoundedQueue(config.get("queue_size", 1000), config.get("overflow", "drop_oldest"))
+        self.to_roomba = BoundedQueue(config.get("queue_size", 1000), config.get("overflow", "drop_oldest"))
+        self.max_pending = config.get("max_pending", 100)
+        self.flush_pending = asyncio.Event()
+        super().__init__(settings)
+
+    def start(self):
+        """clients are connected from within the event loop, see run()"""
+        self.upstream_helper = AsyncioHelper(self.event_loop, self.upstream)
+        for robot in self.robots:
+            AsyncioHelper(self.event_loop, robot.client)
+
+    def on_message(self, client, userdata, msg):
+        """The callback for when a PUBLISH message is received from the server. Runs inside the event loop."""
+        if id(client) == id(self.upstream):
+            self.to_roomba.put((time.monotonic(), msg))
+        else:
+            self.to_upstream.put((time.monotonic(), userdata, msg))
+
+    async def upstream_worker(self):
+        """forward messages from roomba to upstream broker"""
+        while True:
+            # backpressure: don't take more messages while the upstream broker does not keep up
+            while self.upstream.socket() is not None and pending_output(self.upstream) > self.max_pending:
+                await self.upstream_helper.drained.wait()
+            received, robot, msg = await self.to_upstream.get()
+            try:
+                self.forward_state(robot, msg, received)
+            except Exception as e:
+                self.debug("failed to forward message from roomba - " + str(e), 1)
+            # held-back messages might be pending now
+            self.flush_pending.set()
+
+    async def roomba_worker(self):
+        """forward commands from upstream broker to roomba"""
+        while True:
+            received, msg = await self.to_roomba.get()
+            try:
+                self.handle_upstream(msg, received)
+            except Exception as e:
+                self.debug("failed to forward command to roomba - " + str(e), 1)
+
+    async def flush_worker(self):
+        """publish rate limited messages as soon as they are due"""
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_pending.wait(), self.throttle.next_due())
+            except asyncio.TimeoutError:
+                pass
+            self.flush_pending.clear()
+            for topic, payload, retain in self.throttle.flush():
+                self.forward(topic, payload, retain)
+
+    def queue_depth(self):
+        """returns the current depth of both queues, to_upstream including the output paho did not write yet"""
+        return {"to_upstream": self.to_upstream.depth() + pending_output(self.upstream), "to_roomba": self.to_roomba.depth()}
+
+    def collect_metrics(self):
+        """returns a snapshot of all metrics"""
+        snapshot = super().collect_metrics()
+        snapshot["queues"] = {name: {"depth": queue.depth(), "max": queue.max_depth, "dropped": queue.dropped} for name, queue in [("to_upstream", self.to_upstream), ("to_roomba", self.to_roomba)]}
+        snapshot["queues"]["to_upstream"]["pending"] = pending_output(self.upstream)
+        return snapshot
+
+    def report(self):
+        """print some statistics"""
+        super().report()
+        for name, queue in [("to_upstream", self.to_upstream), ("to_roomba", self.to_roomba)]:
+            self.debug("queue {}: depth={} max={} dropped={}".format(name, queue.depth(), queue.max_depth, queue.dropped), 2)
+        self.debug("upstream output pending: {}".format(pending_output(self.upstream)), 2)
+
+    async def keep_connected(self, client, host, port):
+        """(re-)connect with exponential backoff whenever the connection to a broker is lost"""
+        delay = self.reconnect["min_delay"]
+        while True:
+            if client.socket() is None:
+                try:
+                    # connect (DNS, TCP and TLS handshake) blocks, so it runs in an executor thread
+                    await self.event_loop.run_in_executor(None, functools.partial(client.connect, host, port=port))
+                    delay = self.reconnect["min_delay"]
+                except OSError as e:
+                    self.debug("Connection to {}:{} failed ({}), retrying in {}s".format(host, port, e, delay), 1)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.reconnect["max_delay"])
+                    continue
+            await asyncio.sleep(1)
+
+    async def run(self):
+        # keep references to the worker tasks
+        self.workers = [
+            self.event_loop.create_task(self.keep_connected(self.upstream, self.settings["upstream"]["host"], self.settings["upstream"]["port"])),
+            self.event_loop.create_task(self.upstream_worker()),
+            self.event_loop.create_task(self.roomba_worker()),
+            self.event_loop.create_task(self.flush_worker()),
+        ]
+        for robot in self.robots:
+            self.workers.append(self.event_loop.create_task(self.keep_connected(robot.client, robot.settings["host"], robot.settings["port"])))
+
+        while True:
+            await asyncio.sleep(1)
+            self.tick()
+
+    def loop(self):
+        """main loop"""
+        self.event_loop.run_until_complete(self.run())
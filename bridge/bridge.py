@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import time
+import threading
 from datetime import datetime, timedelta
 
 import paho.mqtt.client as mqtt
@@ -10,44 +11,119 @@ import ssl
 import json
 
 from settings import settings
+from forward import ForwardCache, Throttle
+from spool import Spool
+from metrics import Metrics, serve
+from shadow import Shadow
 
-class RoombaBridge(object):
-    """ Bridge topics from the roomba broker to any MQTT broker 
+class Robot(object):
+    """ Connection to the mqtt broker of a single roomba
     The roomba uses a certificate signed by some "ROOMBA CA". This root CA is not publicly available afaik.
     To connect to the roomba broker via TLS w/o checking the certificate we MUST set
         cert_reqs=ssl.CERT_NONE
     """
-    def __init__(self, settings):
+    def __init__(self, settings, upstream, name=None):
         self.settings = settings
+        self.name = settings.get("name", name)
+
+        # where to publish state to and read commands from on the upstream broker
+        if self.name is None:
+            self.publish = settings.get("publish", upstream["publish"])
+            self.subscribe = settings.get("subscribe", upstream["subscribe"])
+            self.snapshot = settings.get("snapshot", upstream.get("snapshot"))
+            self.snapshot_request = settings.get("snapshot_request", upstream.get("snapshot_request"))
+        else:
+            self.publish = settings.get("publish", upstream["publish"] + "/" + self.name)
+            self.subscribe = settings.get("subscribe", upstream["subscribe"] + "/" + self.name)
+            self.snapshot = settings.get("snapshot", upstream["snapshot"] + "/" + self.name if upstream.get("snapshot") else None)
+            self.snapshot_request = settings.get("snapshot_request", upstream["snapshot_request"] + "/" + self.name if upstream.get("snapshot_request") else None)
 
-        # setup roomba mqtt stuff
-        self.roomba = mqtt.Client(
-                client_id=self.settings["roomba"]["user"], 
+        # complete reported state, published as a whole to the snapshot topic
+        self.shadow = Shadow()
+
+        # topics to subscribe to on the roomba broker. A standard broker (e.g. to replay recorded traffic)
+        # needs "$aws/things/#" in addition, as "#" does not match topics starting with "$" there.
+        self.topics = settings.get("topics", ["#"])
+
+        self.client = mqtt.Client(
+                client_id=self.settings["user"], 
                 clean_session=True,
-                protocol=mqtt.MQTTv311
+                protocol=mqtt.MQTTv311,
+                userdata=self
             )
-        self.roomba.on_connect = self.on_connect
-        self.roomba.on_message = self.on_message
 
-        context = ssl.SSLContext()
-        context.set_ciphers('DEFAULT@SECLEVEL=1')
-        self.roomba.tls_set_context(context)
+        if self.settings.get("tls", True):
+            context = ssl.SSLContext()
+            context.set_ciphers('DEFAULT@SECLEVEL=1')
+            self.client.tls_set_context(context)
         
-        self.roomba.tls_insecure_set(True)
-        self.roomba.username_pw_set(self.settings["roomba"]["user"], self.settings["roomba"]["pass"])    
+            self.client.tls_insecure_set(True)
+        self.client.username_pw_set(self.settings["user"], self.settings["pass"])    
+
+    def __str__(self):
+        return self.name or self.settings["host"]
+
+
+class RoombaBridge(object):
+    """ Bridge topics from one or more roomba brokers to any MQTT broker.
+    All robots share a single connection to the upstream broker.
+    """
+    def __init__(self, settings):
+        self.settings = settings
 
-        # FIXME: move to loop() to handle temporary unavailability of the roomba broker
-        self.roomba.connect(self.settings["roomba"]["host"], port=self.settings["roomba"]["port"])
-        self.roomba.loop_start()
+        # last published value per upstream topic to suppress unchanged state updates
+        self.cache = ForwardCache(self.settings["upstream"].get("heartbeat", 0))
+
+        # rate limit high-frequency state keys; held-back values are published by flush_loop()
+        self.throttle = Throttle(self.settings["upstream"].get("policy", {}))
+
+        # keep messages on disk while the upstream broker is not available
+        self.spool = None
+        if self.settings["upstream"].get("spool"):
+            self.spool = Spool(self.settings["upstream"]["spool"], self.settings["upstream"].get("spool_max_size", 10000000), self.settings["upstream"].get("spool_max_age", 86400))
+        # message ids of replayed messages that were not acknowledged by the upstream broker yet
+        self.replay_pending = set()
+
+        # message counters and latencies, published to settings["metrics"]["topic"] every few seconds
+        self.metrics = Metrics()
+        if self.settings.get("metrics", {}).get("http_port"):
+            serve(self.metrics, self.settings["metrics"]["http_port"])
+
+        # setup roomba mqtt stuff; settings["roomba"] is either a single robot or a list of robots
+        if isinstance(self.settings["roomba"], list):
+            self.robots = [Robot(robot, self.settings["upstream"], name="roomba{}".format(n)) for n, robot in enumerate(self.settings["roomba"])]
+        else:
+            self.robots = [Robot(self.settings["roomba"], self.settings["upstream"])]
 
         # setup upstream mqtt stuff
         self.upstream = mqtt.Client()
-        self.upstream.on_connect = self.on_connect
-        self.upstream.on_message = self.on_message
 
-        self.upstream.connect(self.settings["upstream"]["host"], port=self.settings["upstream"]["port"])
+        self.reconnect = self.settings.get("reconnect", {"min_delay": 1, "max_delay": 120})
+        for client in [self.upstream] + [robot.client for robot in self.robots]:
+            client.on_connect = self.on_connect
+            client.on_disconnect = self.on_disconnect
+            client.on_message = self.on_message
+            client.reconnect_delay_set(min_delay=self.reconnect["min_delay"], max_delay=self.reconnect["max_delay"])
+        self.upstream.on_publish = self.on_publish
+
+        # time of the last run of the periodic tasks in tick()
+        self.last_tick = {"report": time.monotonic(), "metrics": time.monotonic(), "snapshot": time.monotonic()}
+
+        self.start()
+
+    def start(self):
+        """connect to all brokers and run the network loops in background threads.
+        The network threads (re-)connect with exponential backoff whenever a broker is not available.
+        """
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+
+        self.upstream.connect_async(self.settings["upstream"]["host"], port=self.settings["upstream"]["port"])
         self.upstream.loop_start()
 
+        for robot in self.robots:
+            robot.client.connect_async(robot.settings["host"], port=robot.settings["port"])
+            robot.client.loop_start()
+
     def debug(self, message, level=2):
         if self.settings["debug"] >= level:
           try:
@@ -57,60 +133,222 @@ class RoombaBridge(object):
 
     def on_connect(self, client, userdata, flags, rc):
         """The callback for when the client receives a CONNACK response from the server."""
-        if id(client) == id(self.roomba):
-            self.debug("Connected to roomba mqtt broker with result code "+str(rc))
-            client.subscribe("#")
-
-        elif id(client) == id(self.upstream):
+        if id(client) == id(self.upstream):
             self.debug("Connected to upstream mqtt broker with result code "+str(rc))
-            client.subscribe(self.settings["upstream"]["subscribe"])
+            for robot in self.robots:
+                client.subscribe(robot.subscribe)
+                if robot.snapshot_request:
+                    client.subscribe(robot.snapshot_request)
+
+            # the broker might have lost its retained messages; make sure everything is published again
+            self.cache.clear()
+
+            # catch up with everything that happened while upstream was not available
+            if self.spool and rc == 0:
+                self.replay_spool()
+
+        else:
+            self.debug("Connected to roomba mqtt broker ({}) with result code {}".format(userdata, rc))
+            for topic in userdata.topics:
+                client.subscribe(topic)
+
+    def replay_spool(self):
+        """publish the spooled messages (QoS 1); the spool is cut once the broker acknowledged all of them"""
+        while True:
+            messages = self.spool.replay()
+            if messages:
+                break
+            if self.spool.acknowledged():
+                return
+        self.debug("replaying {} spooled messages".format(len(messages)), 2)
+        self.replay_pending = set()
+        for topic, payload, retain in messages:
+            info = self.upstream.publish(topic, payload, qos=1, retain=retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                # connection lost again, everything stays in the spool
+                self.debug("replay failed with result code {}".format(info.rc), 1)
+                self.spool.go_offline()
+                return
+            self.replay_pending.add(info.mid)
+
+    def on_publish(self, client, userdata, mid):
+        """The callback for when the upstream broker acknowledged a message."""
+        if mid in self.replay_pending:
+            self.replay_pending.discard(mid)
+            if not self.replay_pending and not self.spool.acknowledged():
+                # messages were spooled during the replay
+                self.replay_spool()
+
+    def on_disconnect(self, client, userdata, rc):
+        """The callback for when the client disconnects from the server."""
+        if id(client) == id(self.upstream):
+            self.debug("Disconnected from upstream mqtt broker with result code "+str(rc), 1)
+            if self.spool:
+                self.spool.go_offline()
+        else:
+            self.debug("Disconnected from roomba mqtt broker ({}) with result code {}".format(userdata, rc), 1)
 
     def on_message(self, client, userdata, msg):
         """The callback for when a PUBLISH message is received from the server."""
-        if id(client) == id(self.roomba): 
-            # forward message from roomba to upstream broker
-            self.debug("msg from roomba - " + str(msg.topic) + ': ' + str(msg.payload), 3)
-            data = json.loads(msg.payload.decode("utf-8"))
-            if msg.topic.startswith('wifistat') or msg.topic.startswith('$aws/things'):
-                if "state" in data:
-                    if "reported" in data["state"]:
-                        for key, value in data["state"]["reported"].items():
-                            retain = True
-                            # disable message retain for specific topics
-                            if key in self.settings["upstream"]["non_retain"]:
-                                retain = False
-                            self.upstream.publish(self.settings["upstream"]["publish"]+"/"+str(key), json.dumps(value), retain=retain)
-                    else:
-                        self.debug(str(msg.topic) + ': ' + str(msg.payload))
+        if id(client) == id(self.upstream):
+            self.handle_upstream(msg)
+        else:
+            self.forward_state(userdata, msg)
+
+    def handle_upstream(self, msg, received=None):
+        """dispatch a message from the upstream broker to the robot it is meant for"""
+        for robot in self.robots:
+            if robot.snapshot_request and mqtt.topic_matches_sub(robot.snapshot_request, msg.topic):
+                self.send_snapshot(robot, msg.payload.decode("utf-8"))
+                return
+            if mqtt.topic_matches_sub(robot.subscribe, msg.topic):
+                self.forward_command(robot, msg, received)
+                return
+
+    def send_snapshot(self, robot, response_topic=""):
+        """publish the whole shadow state of a robot to the given topic or to its snapshot topic"""
+        self.debug("snapshot requested for " + str(robot), 3)
+        if response_topic:
+            self.upstream.publish(response_topic, robot.shadow.dumps())
+        elif robot.snapshot:
+            self.upstream.publish(robot.snapshot, robot.shadow.dumps(), retain=True)
+
+    def forward_state(self, robot, msg, received=None):
+        """forward message from roomba to upstream broker"""
+        if received is None:
+            received = time.monotonic()
+        else:
+            # the message waited in a queue
+            self.metrics.dequeued(received, time.monotonic())
+        self.metrics.count("from_roomba")
+        self.debug("msg from roomba " + str(robot) + " - " + str(msg.topic) + ': ' + str(msg.payload), 3)
+        start = time.monotonic()
+        data = json.loads(msg.payload.decode("utf-8"))
+        self.metrics.decoded(start, time.monotonic())
+        if msg.topic.startswith('wifistat') or msg.topic.startswith('$aws/things'):
+            if "state" in data:
+                if "reported" in data["state"]:
+                    robot.shadow.update(data["state"]["reported"])
+                    for key, value in data["state"]["reported"].items():
+                        retain = True
+                        # disable message retain for specific topics
+                        if key in self.settings["upstream"]["non_retain"]:
+                            retain = False
+                        if key == "cleanMissionStatus" and isinstance(value, dict):
+                            # only the phase counts as answer to a command, the mission timer changes every minute
+                            self.metrics.mission_status(str(robot), value.get("phase"))
+                        self.metrics.offered(robot.publish+"/"+str(key), received)
+                        for topic, payload, retain in self.throttle.offer(key, robot.publish+"/"+str(key), json.dumps(value), retain):
+                            self.forward(topic, payload, retain)
                 else:
                     self.debug(str(msg.topic) + ': ' + str(msg.payload))
             else:
                 self.debug(str(msg.topic) + ': ' + str(msg.payload))
-        elif id(client) == id(self.upstream):
-            # forward commands from upstream broker to roomba
-            self.debug("msg from upstream - " + str(msg.topic) + ': ' + str(msg.payload), 2)
-            
-            cmd = msg.payload.decode("utf-8")
-            if ( self.settings["roomba"]["enable_whitelist"] == True and cmd in self.settings["roomba"]["whitelist"] ) or self.settings["roomba"]["enable_whitelist"] == False:
-                payload = {
-                    "command": cmd,
-                    "time" : int(datetime.utcnow().timestamp()),
-                    "initiator": "localApp",
-                }
-                self.debug("sending to roomba:" + json.dumps(payload), 3)
-                self.roomba.publish("cmd", json.dumps(payload))                
-            else:
-                self.debug("command blocked by whitelist - " + cmd, 1)
+        else:
+            self.debug(str(msg.topic) + ': ' + str(msg.payload))
+
+    def forward_command(self, robot, msg, received=None):
+        """forward commands from upstream broker to roomba"""
+        if received is None:
+            received = time.monotonic()
+        self.metrics.count("from_upstream")
+        self.debug("msg from upstream - " + str(msg.topic) + ': ' + str(msg.payload), 2)
+        
+        cmd = msg.payload.decode("utf-8")
+        if ( robot.settings["enable_whitelist"] == True and cmd in robot.settings["whitelist"] ) or robot.settings["enable_whitelist"] == False:
+            payload = {
+                "command": cmd,
+                "time" : int(datetime.utcnow().timestamp()),
+                "initiator": "localApp",
+            }
+            self.debug("sending to roomba " + str(robot) + ":" + json.dumps(payload), 3)
+            robot.client.publish("cmd", json.dumps(payload))                
+            self.metrics.command_sent(str(robot), received)
+        else:
+            self.debug("command blocked by whitelist - " + cmd, 1)
+
+    def forward(self, topic, payload, retain=True):
+        """publish to the upstream broker unless the value did not change since the last publish"""
+        if not self.cache.changed(topic, payload):
+            self.debug("unchanged - " + topic, 3)
+            return
+
+        if self.spool and self.spool.store(topic, payload, retain):
+            return
+
+        info = self.upstream.publish(topic, payload, retain=retain)
+        if info.rc == mqtt.MQTT_ERR_NO_CONN and self.spool:
+            # connection was lost in the meantime
+            self.spool.go_offline()
+            self.spool.store(topic, payload, retain)
+        else:
+            self.metrics.published(topic)
+
+    def flush_loop(self):
+        """publish rate limited messages as soon as they are due"""
+        while True:
+            self.throttle.wakeup.clear()
+            self.throttle.wakeup.wait(self.throttle.next_due())
+            for topic, payload, retain in self.throttle.flush():
+                self.forward(topic, payload, retain)
+
+    def report(self):
+        """print some statistics"""
+        self.debug("suppressed {} unchanged and {} coalesced publishes so far".format(self.cache.suppressed, self.throttle.coalesced), 2)
+        if self.spool:
+            self.debug("spooled {}, replayed {} and dropped {} messages so far".format(self.spool.spooled, self.spool.replayed, self.spool.dropped), 2)
+
+    def collect_metrics(self):
+        """returns a snapshot of all metrics"""
+        snapshot = self.metrics.snapshot()
+        snapshot["suppressed"] = self.cache.suppressed
+        snapshot["coalesced"] = self.throttle.coalesced
+        if self.spool:
+            snapshot["spool"] = {"spooled": self.spool.spooled, "replayed": self.spool.replayed, "dropped": self.spool.dropped}
+        return snapshot
+
+    def publish_metrics(self):
+        """publish a snapshot of all metrics to the metrics topic"""
+        snapshot = self.collect_metrics()
+        if self.settings.get("metrics", {}).get("topic"):
+            self.upstream.publish(self.settings["metrics"]["topic"], json.dumps(snapshot))
+
+    def tick(self, now=None):
+        """periodic tasks, called about once per second"""
+        if now is None:
+            now = time.monotonic()
+
+        # report statistics every minute
+        if now - self.last_tick["report"] >= self.settings.get("report", 60):
+            self.last_tick["report"] = now
+            self.report()
+
+        if now - self.last_tick["metrics"] >= self.settings.get("metrics", {}).get("interval", 10):
+            self.last_tick["metrics"] = now
+            self.publish_metrics()
+
+        # publish changed shadow state documents
+        if now - self.last_tick["snapshot"] >= self.settings["upstream"].get("snapshot_interval", 5):
+            self.last_tick["snapshot"] = now
+            for robot in self.robots:
+                snapshot = robot.shadow.changes() if robot.snapshot else None
+                if snapshot:
+                    self.forward(robot.snapshot, snapshot, True)
 
     def loop(self):
         """main loop"""
         while True:
             time.sleep(1)
+            self.tick()
 
 
 if __name__ == '__main__':
     
-    bridge = RoombaBridge(settings)
+    if settings.get("engine", "thread") == "asyncio":
+        from aiobridge import AsyncRoombaBridge
+        bridge = AsyncRoombaBridge(settings)
+    else:
+        bridge = RoombaBridge(settings)
     try:
         bridge.loop()
     except (KeyboardInterrupt, SystemExit):
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+
+class ForwardCache(object):
+    """ Remember the last payload that was published per upstream topic.
+    The roomba reports its complete shadow state over and over again, but most values do not change in between.
+    Publishing only changed values keeps the upstream broker (and its retained store) quiet.
+    An optional heartbeat (in seconds) re-publishes unchanged values every now and then.
+    """
+    def __init__(self, heartbeat=0):
+        self.heartbeat = heartbeat
+        self.last = {}  # topic -> (payload, time of last publish)
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def changed(self, topic, payload, now=None):
+        """returns True if the payload must be published, False if it can be suppressed"""
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            last = self.last.get(topic)
+            if last is not None and last[0] == payload:
+                if not self.heartbeat or (now - last[1]) < self.heartbeat:
+                    self.suppressed += 1
+                    return False
+
+            self.last[topic] = (payload, now)
+            return True
+
+    def clear(self):
+        """forget all cached values, e.g. after a (re-)connect to a broker that might have lost its retained messages"""
+        with self.lock:
+            self.last.clear()
+
+
+class Throttle(object):
+    """ Apply a per-key forwarding policy to high-frequency state keys (e.g. pose, signal).
+    Supported policies:
+        {"mode": "pass"}                    forward every message (default for keys without policy)
+        {"mode": "rate", "rate": 2}         forward at most 2 messages per second; the latest held-back value is sent when the interval ends
+        {"mode": "coalesce", "window": 1}   collect all messages within a 1s window and forward only the latest one at its end
+    Held-back messages are released by calling flush(); next_due() tells when that is necessary.
+    """
+    def __init__(self, policies):
+        self.policies = policies
+        self.pending = {}   # topic -> (due time, (topic, payload, retain))
+        self.last = {}      # topic -> time of last release
+        self.coalesced = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def offer(self, key, topic, payload, retain=True, now=None):
+        """returns a list of (topic, payload, retain) that must be published right away"""
+        policy = self.policies.get(key, {})
+        mode = policy.get("mode", "pass")
+        if mode == "pass":
+            return [(topic, payload, retain)]
+
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            if topic in self.pending:
+                # latest value wins, keep the deadline of the pending message
+                due = self.pending[topic][0]
+                self.coalesced += 1
+            elif mode == "rate":
+                last = self.last.get(topic)
+                interval = 1. / policy["rate"]
+                if last is None or (now - last) >= interval:
+                    self.last[topic] = now
+                    return [(topic, payload, retain)]
+                due = last + interval
+            elif mode == "coalesce":
+                due = now + policy["window"]
+            else:
+                raise ValueError("unknown forwarding policy '{}' for {}".format(mode, key))
+
+            self.pending[topic] = (due, (topic, payload, retain))
+
+        self.wakeup.set()
+        return []
+
+    def flush(self, now=None):
+        """returns a list of held-back (topic, payload, retain) that are due"""
+        if now is None:
+            now = time.monotonic()
+
+        released = []
+        with self.lock:
+            for topic, (due, message) in list(self.pending.items()):
+                if due <= now:
+                    released.append(message)
+                    self.last[topic] = now
+                    del self.pending[topic]
+        return released
+
+    def next_due(self, now=None):
+        """returns the number of seconds until the next flush is due or None if nothing is pending"""
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            if not self.pending:
+                return None
+            return max(0, min(due for due, _ in self.pending.values()) - now)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import time
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+class Histogram(object):
+    """ Latency histogram with fixed buckets (upper bounds in ms) """
+    BOUNDS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def add(self, value):
+        """add a value in ms"""
+        n = 0
+        while n < len(self.BOUNDS) and value > self.BOUNDS[n]:
+            n += 1
+        self.counts[n] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """returns the upper bound of the bucket that contains the p-th percentile"""
+        rank = p / 100. * self.count
+        total = 0
+        for n, count in enumerate(self.counts):
+            total += count
+            if count and total >= rank:
+                return self.BOUNDS[n] if n < len(self.BOUNDS) else self.max
+        return 0.
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": {str(bound): count for bound, count in zip(self.BOUNDS + ["inf"], self.counts) if count},
+        }
+
+
+class Metrics(object):
+    """ Message counters, per-topic rates and latency histograms of the bridge.
+    All latencies are in ms:
+        decode: json decoding of a message from the roomba
+        queue: message received from the roomba until a worker picks it up (asyncio engine only)
+        forward: message received from the roomba until published upstream (including time spent in queues and the throttle)
+        command: command received from upstream until the next change of cleanMissionStatus
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"from_roomba": 0, "to_upstream": 0, "from_upstream": 0, "to_roomba": 0}
+        self.topics = {}        # upstream topic -> number of published messages since last snapshot
+        self.received = {}      # upstream topic -> time the latest value was received from the roomba
+        self.commands = {}      # robot -> time of the last command that has not been answered yet
+        self.status = {}        # robot -> last cleanMissionStatus
+        self.decode = Histogram()
+        self.queue = Histogram()
+        self.forward = Histogram()
+        self.command = Histogram()
+        self.since = time.monotonic()
+        self.last = {}
+
+    def count(self, direction, topic=None):
+        with self.lock:
+            self.counters[direction] += 1
+            if topic is not None:
+                self.topics[topic] = self.topics.get(topic, 0) + 1
+
+    def decoded(self, start, end):
+        with self.lock:
+            self.decode.add((end - start) * 1000)
+
+    def dequeued(self, received, now):
+        with self.lock:
+            self.queue.add((now - received) * 1000)
+
+    def offered(self, topic, received):
+        """remember when the value of an upstream topic was received"""
+        with self.lock:
+            self.received[topic] = received
+
+    def published(self, topic, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.counters["to_upstream"] += 1
+            self.topics[topic] = self.topics.get(topic, 0) + 1
+            received = self.received.pop(topic, None)
+            if received is not None:
+                self.forward.add((now - received) * 1000)
+
+    def command_sent(self, robot, received):
+        with self.lock:
+            self.counters["to_roomba"] += 1
+            self.commands[robot] = received
+
+    def mission_status(self, robot, status, now=None):
+        """record the command round-trip time if the mission status changed"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if robot in self.status and self.status[robot] != status and robot in self.commands:
+                self.command.add((now - self.commands.pop(robot)) * 1000)
+            self.status[robot] = status
+
+    def snapshot(self, now=None):
+        """returns all metrics as dict; per-topic rates are messages per second since the last snapshot"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            elapsed = max(now - self.since, 1e-3)
+            self.last = {
+                "time": int(time.time()),
+                "counters": dict(self.counters),
+                "rates": {topic: round(count / elapsed, 3) for topic, count in self.topics.items()},
+                "latency": {
+                    "decode": self.decode.snapshot(),
+                    "queue": self.queue.snapshot(),
+                    "forward": self.forward.snapshot(),
+                    "command": self.command.snapshot(),
+                },
+            }
+            self.topics = {}
+            self.since = now
+            return self.last
+
+
+def serve(metrics, port, host=""):
+    """serve the latest metrics snapshot as json on http://<host>:<port>/ from a background thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(metrics.last).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
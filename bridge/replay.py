@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Record mqtt traffic of the roomba and/or the upstream broker into a compact binary log and replay it
+against a (local) broker to load test the bridge and its consumers without a robot.
+
+    python3 replay.py record traffic.log --upstream --duration 3600
+    python3 replay.py replay traffic.log --host localhost --speed 10 --watch "home/roomba/state/#"
+    python3 replay.py replay traffic.log --source roomba --port 1884 --speed 0 --watch "home/roomba/state/#" --watch-port 1883
+
+Note: the roomba only accepts a single mqtt connection, so stop the bridge while recording with --roomba.
+To feed replayed robot traffic into the bridge, point its "roomba" settings at the local broker with
+"tls": False and "topics": ["#", "$aws/things/#"].
+
+Log format: magic b"RMQL", version (u8), followed by records of
+    time since start [s] (f64), source (u8, 0=roomba, 1=upstream), flags (u8, bit 0=retain),
+    robot length (u8), topic length (u16), payload length (u32), robot, topic, payload
+The robot is the name (or host) of the robot a message came from, empty for upstream traffic. Version 1 logs
+(without robot) can still be read.
+"""
+
+import time
+import struct
+import hashlib
+import collections
+import argparse
+import threading
+
+import paho.mqtt.client as mqtt
+
+MAGIC = b"RMQL"
+VERSION = 2
+HEADER = struct.Struct("<dBBBHI")
+HEADER_V1 = struct.Struct("<dBBHI")
+SOURCES = ["roomba", "upstream"]
+
+
+class TrafficWriter(object):
+    """ append records to a traffic log; thread-safe """
+    def __init__(self, filename):
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC + bytes([VERSION]))
+        self.start = time.monotonic()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, source, topic, payload, retain=False, robot=""):
+        topic = topic.encode("utf-8")
+        robot = robot.encode("utf-8")[:255]
+        with self.lock:
+            self.file.write(HEADER.pack(time.monotonic() - self.start, source, 1 if retain else 0, len(robot), len(topic), len(payload)))
+            self.file.write(robot)
+            self.file.write(topic)
+            self.file.write(payload)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_log(filename):
+    """yields (time, source, retain, topic, payload, robot) of all records in a traffic log"""
+    with open(filename, "rb") as f:
+        magic, version = f.read(len(MAGIC)), f.read(1)
+        if magic != MAGIC or version not in (bytes([1]), bytes([VERSION])):
+            raise ValueError("{} is not a traffic log".format(filename))
+        header_format = HEADER if version == bytes([VERSION]) else HEADER_V1
+        while True:
+            header = f.read(header_format.size)
+            if len(header) < header_format.size:
+                break
+            if header_format is HEADER:
+                t, source, flags, robot_length, topic_length, payload_length = HEADER.unpack(header)
+            else:
+                t, source, flags, topic_length, payload_length = HEADER_V1.unpack(header)
+                robot_length = 0
+            robot = f.read(robot_length).decode("utf-8")
+            topic = f.read(topic_length).decode("utf-8")
+            payload = f.read(payload_length)
+            if len(payload) < payload_length:
+                # truncated last record
+                break
+            yield t, source, bool(flags & 1), topic, payload, robot
+
+
+def record(args, settings):
+    writer = TrafficWriter(args.log)
+    clients = []
+
+    def on_message(client, userdata, msg):
+        source, robot = userdata
+        writer.write(source, msg.topic, msg.payload, msg.retain, robot)
+
+    def on_connect(client, userdata, flags, rc):
+        for topic in topics[id(client)]:
+            client.subscribe(topic)
+
+    topics = {}     # client -> topics to subscribe to
+    if args.roomba:
+        from bridge import Robot
+        robots = settings["roomba"] if isinstance(settings["roomba"], list) else [settings["roomba"]]
+        for robot in robots:
+            robot = Robot(robot, settings["upstream"])
+            client = robot.client
+            client.user_data_set((SOURCES.index("roomba"), str(robot)))
+            topics[id(client)] = robot.topics
+            client.on_connect = on_connect
+            client.on_message = on_message
+            client.connect(robot.settings["host"], port=robot.settings["port"])
+            clients.append(client)
+
+    if args.upstream:
+        client = mqtt.Client(userdata=(SOURCES.index("upstream"), ""))
+        topics[id(client)] = [settings["upstream"]["publish"] + "/#"]
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect(settings["upstream"]["host"], port=settings["upstream"]["port"])
+        clients.append(client)
+
+    for client in clients:
+        client.loop_start()
+
+    start = time.monotonic()
+    try:
+        while not args.duration or time.monotonic() - start < args.duration:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    for client in clients:
+        client.loop_stop()
+    writer.close()
+    print("recorded {} messages in {:.0f}s".format(writer.count, time.monotonic() - start))
+
+
+class Watcher(object):
+    """ subscribe to the output of a consumer and measure when messages arrive.
+    Replayed messages are matched to received ones by topic and payload, so other messages on the same topic (e.g.
+    the output of the bridge for replayed robot traffic) do not give wrong latencies.
+    """
+    def __init__(self, host, port, topics):
+        self.subscriptions = topics
+        self.lock = threading.Lock()
+        self.sent = {}      # (topic, payload hash) -> deque of send times not yet received
+        self.received = 0
+        self.last = None
+        self.latencies = []
+        self.client = mqtt.Client()
+        self.client.on_message = self.on_message
+        self.client.connect(host, port=port)
+        for topic in topics:
+            self.client.subscribe(topic)
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, msg):
+        now = time.monotonic()
+        with self.lock:
+            self.received += 1
+            self.last = now
+            # messages that were replayed with the same topic and payload give an exact latency
+            sent = self.sent.get(self.key(msg.topic, msg.payload))
+            if sent:
+                self.latencies.append(now - sent.popleft())
+
+    @staticmethod
+    def key(topic, payload):
+        return topic, hashlib.blake2b(payload, digest_size=8).digest()
+
+    def published(self, topic, payload, now):
+        """remember when a message was replayed on a watched topic"""
+        if any(mqtt.topic_matches_sub(sub, topic) for sub in self.subscriptions):
+            with self.lock:
+                self.sent.setdefault(self.key(topic, payload), collections.deque()).append(now)
+
+
+def replay(args):
+    sources = [SOURCES.index(source) for source in args.source]
+    messages = [record for record in read_log(args.log) if record[1] in sources
+                and (not args.robot or record[1] != SOURCES.index("roomba") or record[5] in args.robot)]
+    if not messages:
+        print("nothing to replay")
+        return
+
+    client = mqtt.Client()
+    client.max_inflight_messages_set(1000)
+    client.connect(args.host, port=args.port)
+    client.loop_start()
+
+    watcher = None
+    if args.watch:
+        watcher = Watcher(args.watch_host or args.host, args.watch_port or args.port, args.watch)
+        # wait for the subscriptions to be active
+        time.sleep(1)
+
+    start = time.monotonic()
+    offset = messages[0][0]
+    info = None
+    for t, source, retain, topic, payload, robot in messages:
+        if args.speed > 0:
+            delay = (t - offset) / args.speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if watcher:
+            watcher.published(topic, payload, time.monotonic())
+        info = client.publish(topic, payload, retain=retain and args.retain)
+    info.wait_for_publish()
+    duration = time.monotonic() - start
+
+    print("replayed {} messages in {:.2f}s ({:.0f} msg/s, recorded {:.0f} msg/s)".format(
+        len(messages), duration, len(messages) / max(duration, 1e-6), len(messages) / max(messages[-1][0] - offset, 1e-6)))
+
+    if watcher:
+        # wait until the consumers went quiet
+        while True:
+            time.sleep(args.drain)
+            with watcher.lock:
+                if watcher.last is None or time.monotonic() - watcher.last >= args.drain:
+                    break
+        with watcher.lock:
+            print("received {} messages on {}".format(watcher.received, ", ".join(args.watch)))
+            if watcher.last is not None:
+                print("consumer lag after last replayed message: {:.3f}s".format(max(0, watcher.last - (start + duration))))
+            if watcher.latencies:
+                latencies = sorted(watcher.latencies)
+                print("latency of {} matched messages: p50={:.1f}ms p90={:.1f}ms max={:.1f}ms".format(len(latencies),
+                    latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * .9)] * 1000, latencies[-1] * 1000))
+        watcher.client.loop_stop()
+
+    client.loop_stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="record and replay roomba mqtt traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_record = commands.add_parser("record", help="capture traffic into a log (broker settings from settings.py)")
+    parser_record.add_argument("log")
+    parser_record.add_argument("--roomba", action="store_true", help="capture the robot side (wifistat, $aws/things)")
+    parser_record.add_argument("--upstream", action="store_true", help="capture the upstream state topics")
+    parser_record.add_argument("--duration", type=float, default=0, help="stop after x seconds (default: until Ctrl-C)")
+
+    parser_replay = commands.add_parser("replay", help="publish a log to a broker")
+    parser_replay.add_argument("log")
+    parser_replay.add_argument("--host", default="localhost")
+    parser_replay.add_argument("--port", type=int, default=1883)
+    parser_replay.add_argument("--speed", type=float, default=1, help="1=realtime, N=N times faster, 0=as fast as possible")
+    parser_replay.add_argument("--source", nargs="+", choices=SOURCES, default=SOURCES, help="which side of the log to replay")
+    parser_replay.add_argument("--robot", nargs="+", help="only replay the robot traffic of these robots (name or host)")
+    parser_replay.add_argument("--retain", action="store_true", help="keep the retain flag of recorded messages")
+    parser_replay.add_argument("--watch", nargs="+", help="measure rate and lag of messages on these topics")
+    parser_replay.add_argument("--watch-host", help="broker of the watched topics (default: --host)")
+    parser_replay.add_argument("--watch-port", type=int, help="port of the watched broker (default: --port)")
+    parser_replay.add_argument("--drain", type=float, default=2, help="consumers are done after x seconds without messages")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        if not (args.roomba or args.upstream):
+            parser.error("select --roomba and/or --upstream")
+        from settings import settings
+        record(args, settings)
+    else:
+        replay(args)
@@ -1,5 +1,10 @@
 settings = {
         "debug": 2, # 0=None, 1=Error, 2=Info, 3=Trace
+        "report": 60,   # print statistics every x seconds
+        "engine": "thread",     # thread: one network thread per broker; asyncio: single event loop with bounded queues (see "asyncio")
+        # a single robot; use a list of these to bridge several robots over one upstream connection.
+        # In that case each robot needs a "name" and publishes to <upstream publish>/<name> and reads commands
+        # from <upstream subscribe>/<name> unless "publish" and "subscribe" are given explicitly for that robot.
         "roomba": {
             "host": "roomba.fritz.box",
             "port": 8883,
@@ -15,5 +20,30 @@ settings = {
             "publish" : "home/roomba/state", # where to publish roomba topics to
             "subscribe" : "home/roomba/cmd",   # where to read roomba commands from
             "non_retain": ["pose", "signal"],   # these status messages will not be forwarded to the upstream broker as retained messages
+            "heartbeat": 0,     # re-publish unchanged values after this many seconds (0=only publish changed values)
+            "snapshot": "home/roomba/snapshot",     # publish the whole reported state as one retained document (None=disabled)
+            "snapshot_request": "home/roomba/snapshot/get",     # publish the snapshot on request; the payload may name a response topic (None=disabled)
+            "snapshot_interval": 5,     # publish the snapshot at most every x seconds
+            "spool": "/var/tmp/roombabridge.spool",     # keep messages in this file while the broker is not available (None=disabled)
+            "spool_max_size": 10000000,     # [bytes] drop the oldest spooled messages beyond this size
+            "spool_max_age": 86400,     # [s] drop spooled non-retained messages (e.g. poses) older than this
+            "policy": {         # per-key forwarding policy: pass (default), rate (max. messages per second) or coalesce (latest value within window [s])
+                "pose": {"mode": "rate", "rate": 2},
+                "signal": {"mode": "coalesce", "window": 5},
+            },
+        },
+        "metrics": {        # message counters, rates and latencies of the bridge
+            "topic": "home/roomba/metrics",     # publish a snapshot to this upstream topic (None=disabled)
+            "interval": 10,     # every x seconds
+            "http_port": None,  # also serve the latest snapshot as json on this local port
+        },
+        "reconnect": {      # (re-)connect to unavailable brokers with exponential backoff
+            "min_delay": 1,     # [s]
+            "max_delay": 120,   # [s]
+        },
+        "asyncio": {
+            "queue_size": 1000,     # max. number of messages waiting to be forwarded per direction
+            "overflow": "drop_oldest",  # what to do if a queue is full: drop_oldest or drop_newest
+            "max_pending": 100,     # stop taking messages from the queue while more are not written to the upstream socket yet
         },
     }
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+
+
+class Shadow(object):
+    """ Merged copy of the reported shadow state of a robot.
+    The roomba only reports the keys that changed; these partial updates are merged into one document
+    that can be published as a whole.
+    """
+    def __init__(self):
+        self.state = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def update(self, reported):
+        """merge a partial update of the reported state"""
+        with self.lock:
+            if self._merge(self.state, reported):
+                self.dirty = True
+
+    def _merge(self, target, update):
+        """recursively merge update into target; returns True if anything changed"""
+        changed = False
+        for key, value in update.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                changed = self._merge(target[key], value) or changed
+            elif key not in target or target[key] != value:
+                target[key] = value
+                changed = True
+        return changed
+
+    def dumps(self):
+        """returns the whole document as json"""
+        with self.lock:
+            return json.dumps(self.state)
+
+    def changes(self):
+        """returns the whole document as json if it changed since the last call, None otherwise"""
+        with self.lock:
+            if not self.dirty:
+                return None
+            self.dirty = False
+            return json.dumps(self.state)
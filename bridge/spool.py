@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+
+
+class Spool(object):
+    """ Disk-backed, append-only store for messages that can not be published while the upstream broker is unavailable.
+    Each message is stored as one line of json. Once the broker is back, replay() returns all spooled messages in order,
+    retained topics reduced to their latest value. The file is only cut after acknowledged() confirmed that these were
+    published, so nothing is lost if the connection drops (or the bridge dies) during the replay; messages that
+    survived a restart of the bridge are replayed as well.
+
+    The spool is bounded: non-retained messages older than max_age [s] are dropped, and when the file grows beyond
+    max_size [bytes] it is compacted: retained topics are reduced, then the oldest non-retained messages are dropped
+    down to half the size. The latest values of retained topics are only dropped (oldest first) if they alone exceed it.
+    """
+    def __init__(self, filename, max_size=10000000, max_age=86400):
+        self.filename = filename
+        self.max_size = max_size
+        self.max_age = max_age
+        self.online = False
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.replaying = None   # size of the file when the current replay was read
+        self.expired = 0        # messages of the current replay that are dropped because of their age
+        self.replayed_count = 0 # messages in the current replay
+        self.lock = threading.Lock()
+        self.file = open(self.filename, "a", encoding="utf-8")
+
+    def store(self, topic, payload, retain=True):
+        """spool the message if upstream is offline; returns False if it must be published instead"""
+        with self.lock:
+            if self.online:
+                return False
+            self.file.write(json.dumps({"t": topic, "p": payload, "r": retain, "s": round(time.time(), 3)}) + "\n")
+            self.file.flush()
+            self.spooled += 1
+            if self.max_size and self.file.tell() > self.max_size and self.replaying is None:
+                self._compact(self.max_size // 2)
+            return True
+
+    def go_offline(self):
+        """spool all further messages; a replay that was not acknowledged yet is replayed again"""
+        with self.lock:
+            self.online = False
+            self.replaying = None
+
+    def _read(self, end=None):
+        """returns the spooled records (up to byte offset end), retained topics reduced and expired messages removed,
+        and the number of expired messages"""
+        records = []
+        latest = {}     # retained topic -> index of latest record
+        with open(self.filename, "rb") as f:
+            data = f.read() if end is None else f.read(end)
+        for line in data.decode("utf-8", "replace").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # incomplete last line after a crash
+                continue
+            if record["r"]:
+                latest[record["t"]] = len(records)
+            records.append(record)
+
+        # keep order, but only the latest value of every retained topic
+        expired = time.time() - self.max_age if self.max_age else None
+        kept = [record for n, record in enumerate(records)
+                if (record["r"] and latest[record["t"]] == n) or (not record["r"] and (expired is None or record.get("s", expired) >= expired))]
+        expired = sum(1 for record in records if not record["r"]) - sum(1 for record in kept if not record["r"])
+        return kept, expired
+
+    def _compact(self, size):
+        """rewrites the file with the reduced records, dropping the oldest non-retained ones (then the oldest retained
+        ones) until it is smaller than size"""
+        self.file.close()
+        records, expired = self._read()
+        lines = [json.dumps(record) + "\n" for record in records]
+        sizes = [len(line.encode("utf-8")) for line in lines]
+        total = sum(sizes)
+        keep = [True] * len(lines)
+        for retained in (False, True):
+            for n, record in enumerate(records):
+                if total <= size:
+                    break
+                if record["r"] == retained:
+                    keep[n] = False
+                    total -= sizes[n]
+        self.dropped += expired + keep.count(False)
+        self._rewrite("".join(line for line, kept in zip(lines, keep) if kept).encode("utf-8"))
+        self.file = open(self.filename, "a", encoding="utf-8")
+
+    def _rewrite(self, data):
+        """replaces the content of the spool; the new file is written first, so a crash never loses messages"""
+        with open(self.filename + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(self.filename + ".tmp", self.filename)
+
+    def replay(self):
+        """returns a list of spooled (topic, payload, retain) to publish. The spool stays unchanged until
+        acknowledged() is called once all of them were published."""
+        with self.lock:
+            self.file.flush()
+            self.replaying = self.file.tell()
+            records, self.expired = self._read(self.replaying)
+            self.replayed_count = len(records)
+            return [(record["t"], record["p"], record["r"]) for record in records]
+
+    def acknowledged(self):
+        """removes the replayed messages from the spool; returns True if the spool went online, False if messages
+        were spooled in the meantime and have to be replayed as well"""
+        with self.lock:
+            if self.replaying is None:
+                # the connection was lost during the replay
+                return False
+            self.file.close()
+            with open(self.filename, "rb") as f:
+                f.seek(self.replaying)
+                remainder = f.read()
+            self._rewrite(remainder)
+            self.file = open(self.filename, "a", encoding="utf-8")
+            self.replayed += self.replayed_count
+            self.dropped += self.expired
+            self.replaying = None
+            if not remainder:
+                self.online = True
+            return self.online
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Catalog of recorded missions (<timestamp>_path.npz / .rec / .cols, see missions.py) in a SQLite database.
+Keeps the key figures of every mission so queries do not have to open the mission files.
+
+    python3 catalog.py --db missions.sqlite rebuild ../logger
+    python3 catalog.py --db missions.sqlite add ../logger/2018-08-05_191829_path.npz
+    python3 catalog.py --db missions.sqlite query --days 7 --min-area 20
+"""
+
+import os
+import time
+import struct
+import sqlite3
+import zipfile
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+import posecodec
+from raster import rasterize
+from recorder import read_header
+from missions import load_mission, find_missions
+
+# width of vacuum opening
+ROOMBA_WIDTH = 180
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS missions (
+    name TEXT PRIMARY KEY,  -- e.g. 2018-08-05_191829
+    path_file TEXT,         -- absolute filename of the path data
+    wifi_file TEXT,         -- absolute filename of the wifi data (if any)
+    format TEXT,            -- npz, rec, pose or cols
+    start REAL,             -- mission start [s since epoch] (NULL if unknown)
+    end REAL,               -- mission end [s since epoch]
+    samples INTEGER,        -- number of poses
+    minx REAL, miny REAL, maxx REAL, maxy REAL,     -- bounding box [mm]
+    length REAL,            -- path length [m]
+    area REAL,              -- covered area [m²]
+    data_offset INTEGER,    -- file offset of the pose data
+    file_size INTEGER,
+    mtime REAL              -- modification time of path_file when it was indexed
+);
+CREATE INDEX IF NOT EXISTS missions_end ON missions (end);
+"""
+
+
+def covered_area(points, width=ROOMBA_WIDTH, cell=20):
+    """returns the area [m²] covered by a path (points in mm) with the given width, on a grid with cell size [mm]"""
+    if len(points) == 0:
+        return 0.
+    return rasterize(points, scale=cell, width=width).area()
+
+
+def npz_offset(filename, member):
+    """returns the file offset of the array data of an uncompressed npz member (None if compressed)"""
+    with zipfile.ZipFile(filename) as archive:
+        info = archive.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(filename, "rb") as f:
+        # local file header: 30 bytes, followed by the file name and the extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", f.read(4))
+        f.seek(name_length + extra_length, os.SEEK_CUR)
+        if np.lib.format.read_magic(f) == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+        return f.tell()
+
+
+def mission_name(filename):
+    """returns the mission name (timestamp) of a mission file"""
+    name = os.path.basename(filename)
+    for suffix in ["_path.npz", "_path.rec", "_path.pose", "_path.cols"]:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def read_mission(filename):
+    """returns a dict with the catalog entry of a mission file"""
+    name = mission_name(filename)
+    entry = {"name": name, "path_file": os.path.abspath(filename), "start": None, "end": None}
+
+    mission = load_mission(filename)
+    points = mission.points()
+    if "t" in mission and len(mission["t"]):
+        entry["start"], entry["end"] = float(mission["t"][0]), float(mission["t"][-1])
+    entry["format"] = mission.format
+    if mission.format == "rec":
+        entry["data_offset"] = read_header(filename)["data_offset"]
+    elif mission.format == "cols":
+        entry["data_offset"] = mission["points"].offset
+    elif mission.format == "pose":
+        entry["data_offset"] = posecodec.HEADER.size
+    else:
+        entry["data_offset"] = npz_offset(filename, "points.npy")
+
+    if entry["end"] is None:
+        # old files: the name is the time the mission ended
+        try:
+            entry["end"] = time.mktime(datetime.strptime(name, "%Y-%m-%d_%H%M%S").timetuple())
+        except ValueError:
+            entry["end"] = os.path.getmtime(filename)
+
+    points = points.reshape(-1, 2)
+    entry["samples"] = len(points)
+    if len(points):
+        entry["minx"], entry["miny"] = np.amin(points, axis=0).tolist()
+        entry["maxx"], entry["maxy"] = np.amax(points, axis=0).tolist()
+    else:
+        entry["minx"] = entry["miny"] = entry["maxx"] = entry["maxy"] = None
+    entry["length"] = float(np.sum(np.hypot(*np.diff(points, axis=0).T))) / 1000 if len(points) > 1 else 0.
+    entry["area"] = covered_area(points)
+
+    wifi_file = filename.replace("_path.", "_wifi.")
+    entry["wifi_file"] = os.path.abspath(wifi_file) if wifi_file != filename and os.path.exists(wifi_file) else None
+    if os.path.isdir(filename):
+        entry["file_size"] = sum(os.path.getsize(os.path.join(filename, name)) for name in os.listdir(filename))
+    else:
+        entry["file_size"] = os.path.getsize(filename)
+    entry["mtime"] = os.path.getmtime(filename)
+    return entry
+
+
+class Catalog(object):
+    """ SQLite index of missions; use one instance per thread """
+    COLUMNS = ["name", "path_file", "wifi_file", "format", "start", "end", "samples", "minx", "miny", "maxx", "maxy",
+               "length", "area", "data_offset", "file_size", "mtime"]
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, filename):
+        """index (or re-index) a mission file"""
+        entry = read_mission(filename)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO missions ({}) VALUES ({})".format(
+                ", ".join(self.COLUMNS), ", ".join("?" * len(self.COLUMNS))), [entry[column] for column in self.COLUMNS])
+        return entry
+
+    def rebuild(self, directories, force=False):
+        """index all mission files in the given directories; unchanged files are skipped unless force is set"""
+        known = {row["path_file"]: row["mtime"] for row in self.db.execute("SELECT path_file, mtime FROM missions")}
+        count = 0
+        for filename in find_missions(directories):
+            if not force and known.get(filename) == os.path.getmtime(filename):
+                continue
+            try:
+                self.add(filename)
+                count += 1
+            except Exception as e:
+                print("skipping {}: {}".format(filename, e))
+
+        # forget missions whose files are gone
+        with self.db:
+            for filename in known:
+                if not os.path.exists(filename):
+                    self.db.execute("DELETE FROM missions WHERE path_file = ?", (filename,))
+        return count
+
+    def query(self, since=None, until=None, min_area=None, min_samples=None):
+        """returns all matching missions, oldest first"""
+        conditions, parameters = [], []
+        if since is not None:
+            conditions.append("end >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("end < ?")
+            parameters.append(until)
+        if min_area is not None:
+            conditions.append("area > ?")
+            parameters.append(min_area)
+        if min_samples is not None:
+            conditions.append("samples >= ?")
+            parameters.append(min_samples)
+        sql = "SELECT * FROM missions"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [dict(row) for row in self.db.execute(sql + " ORDER BY end", parameters)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="catalog of recorded roomba missions")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logger", "missions.sqlite"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_rebuild = commands.add_parser("rebuild", help="index all missions in the given directories")
+    parser_rebuild.add_argument("directories", nargs="+")
+    parser_rebuild.add_argument("--force", action="store_true", help="re-index unchanged files")
+
+    parser_add = commands.add_parser("add", help="index the given mission files")
+    parser_add.add_argument("files", nargs="+")
+
+    parser_query = commands.add_parser("query", help="list missions")
+    parser_query.add_argument("--days", type=float, help="missions of the last x days")
+    parser_query.add_argument("--min-area", type=float, help="covered area larger than x m²")
+    parser_query.add_argument("--min-samples", type=int)
+
+    args = parser.parse_args()
+    catalog = Catalog(args.db)
+
+    if args.command == "rebuild":
+        print("indexed {} missions".format(catalog.rebuild(args.directories, args.force)))
+    elif args.command == "add":
+        for filename in args.files:
+            catalog.add(filename)
+    else:
+        since = time.time() - args.days * 86400 if args.days else None
+        for mission in catalog.query(since=since, min_area=args.min_area, min_samples=args.min_samples):
+            print("{name}  {samples:6d} poses  {length:7.1f} m  {area:6.2f} m²  {path_file}".format(**mission))
+
+    catalog.close()
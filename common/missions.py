@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Loader for recorded missions in all on-disk formats:
+
+    <name>_path.npz     written by the logger (format "npz"); loaded into memory
+    <name>_path.rec     streamed by the logger (format "rec", see recorder.py); memory-mapped
+    <name>_path.pose    compact archive written by the logger (format "pose", see posecodec.py); decoded into memory
+    <name>_path.cols/   one uncompressed .npy file per column (points.npy, values.npy, t.npy); memory-mapped
+
+Memory-mapped missions only read the parts of the file that are actually used, so time ranges or decimated views
+of large missions are cheap. Convert existing npz files with
+
+    python3 missions.py convert ../logger/*_path.npz ../logger/*_wifi.npz
+"""
+
+import os
+import glob
+import argparse
+
+import numpy as np
+
+import posecodec
+from recorder import open_recording
+
+# 1 robot-unit = 11.8 mm
+ROBOT_UNIT = 11.8
+
+COLUMNS_SUFFIX = ".cols"
+MISSION_PATTERNS = ["*_path.npz", "*_path.rec", "*_path.pose", "*_path" + COLUMNS_SUFFIX]
+
+
+class Mission(object):
+    """ columns of a mission: points (n, 2) in robot units, values (n,) and t (n,) if recorded """
+    def __init__(self, filename, columns, format):
+        self.filename = filename
+        self.columns = columns
+        self.format = format
+
+    def __len__(self):
+        return len(self.columns["points"])
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def points(self, start=None, stop=None, step=None):
+        """returns a slice of the positions in mm; only this slice is read and converted"""
+        return self.columns["points"][start:stop:step].astype(np.float64) * ROBOT_UNIT
+
+    def time_range(self, since=None, until=None):
+        """returns the slice (start, stop) of the samples recorded in [since, until)"""
+        if "t" not in self.columns:
+            raise ValueError("{} has no timestamps".format(self.filename))
+        t = self.columns["t"]
+        start = 0 if since is None else int(np.searchsorted(t, since))
+        stop = len(t) if until is None else int(np.searchsorted(t, until))
+        return start, stop
+
+
+class RecordingColumns(object):
+    """ column access to a memory-mapped recording; points are assembled from x and y on access """
+    def __init__(self, records):
+        self.records = records
+
+    def __contains__(self, name):
+        return name in ("points", "values", "t")
+
+    def __getitem__(self, name):
+        if name == "points":
+            return PointsView(self.records)
+        if name == "values":
+            # the value column follows t, x, y
+            return self.records[self.records.dtype.names[3]]
+        return self.records[name]
+
+
+class PointsView(object):
+    """ (n, 2) view of the x and y columns of a recording that copies only what is sliced """
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        records = self.records[index]
+        return np.column_stack([records["x"], records["y"]])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+def load_mission(filename, mmap=True):
+    """opens a mission in any supported format (see module docstring)"""
+    mode = "r" if mmap else None
+    if os.path.isdir(filename):
+        columns = {os.path.splitext(name)[0]: np.load(os.path.join(filename, name), mmap_mode=mode)
+                   for name in os.listdir(filename) if name.endswith(".npy")}
+        return Mission(filename, columns, "cols")
+    if filename.endswith(".rec"):
+        return Mission(filename, RecordingColumns(open_recording(filename)), "rec")
+    if filename.endswith(".pose"):
+        return Mission(filename, posecodec.load(filename), "pose")
+    with np.load(filename) as npzfile:
+        columns = {name: npzfile[name] for name in npzfile.files}
+    return Mission(filename, columns, "npz")
+
+
+def find_missions(patterns):
+    """returns all path files given as filename, directory or glob pattern"""
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern) and not pattern.rstrip("/").endswith(COLUMNS_SUFFIX):
+            for mission_pattern in MISSION_PATTERNS:
+                filenames += glob.glob(os.path.join(pattern, mission_pattern))
+        else:
+            filenames += glob.glob(pattern)
+    return sorted(set(os.path.abspath(filename.rstrip("/")) for filename in filenames))
+
+
+def convert_npz(filename, directory=None):
+    """writes the arrays of a npz file as uncompressed .npy columns into <name>.cols/ and returns its name"""
+    directory = directory or os.path.splitext(filename)[0] + COLUMNS_SUFFIX
+    os.makedirs(directory, exist_ok=True)
+    with np.load(filename) as npzfile:
+        for name in npzfile.files:
+            np.save(os.path.join(directory, name + ".npy"), np.ascontiguousarray(npzfile[name]))
+    return directory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="convert roomba missions into memory-mappable columns")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_convert = commands.add_parser("convert", help="convert npz files into <name>.cols directories")
+    parser_convert.add_argument("files", nargs="+")
+
+    args = parser.parse_args()
+    for filename in args.files:
+        print(convert_npz(filename))
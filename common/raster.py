@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+""" Rasterizer for robot paths without matplotlib.
+
+Draws polylines of a given width (e.g. ROOMBA_WIDTH) into a boolean grid at a given scale [mm/pixel] and encodes
+images as PNG. Row 0 of a grid is the top (largest y), like in a rendered image.
+
+Segments are sampled at least every half pixel and a disk of the path width is stamped at every sample. A disk is
+stamped scanline by scanline: for every row only the start and end of the covered run are counted, and a cumulative
+sum along the rows fills the runs. This needs 2 * (2 * radius + 1) writes per covered pixel instead of one per
+pixel of the disk.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+# width of vacuum opening
+ROOMBA_WIDTH = 180
+
+
+def densify(points, step):
+    """returns the points with additional samples on every segment, so no two samples are further apart than step"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return points
+    vectors = np.diff(points, axis=0)
+    steps = np.maximum(1, np.ceil(np.hypot(vectors[:, 0], vectors[:, 1]) / step)).astype(np.int64)
+    segment = np.repeat(np.arange(len(vectors)), steps)
+    fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    return np.vstack([points[segment] + vectors[segment] * fraction[:, None], points[-1:]])
+
+
+def stamp(grid, rows, cols, radius):
+    """sets all pixels of grid within radius [pixel] of the given pixels; pixels outside of the grid are clipped"""
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    if len(rows) == 0:
+        return grid
+
+    # only work on the part of the grid that is touched (e.g. a few new positions)
+    r = int(np.floor(radius))
+    top, left = max(rows.min() - r, 0), max(cols.min() - r, 0)
+    bottom, right = min(rows.max() + r + 1, grid.shape[0]), min(cols.max() + r + 1, grid.shape[1])
+    if top < bottom and left < right:
+        _stamp(grid[top:bottom, left:right], rows - top, cols - left, radius)
+    return grid
+
+
+def _stamp(grid, rows, cols, radius):
+    height, width = grid.shape
+    r = int(np.floor(radius))
+
+    # remove duplicate pixels (and those too far outside) with a grid of the centers, this is faster than sorting
+    rows = rows + r
+    cols = cols + r
+    inside = (rows >= 0) & (rows < height + 2 * r) & (cols >= 0) & (cols < width + 2 * r)
+    centers = np.zeros((height + 2 * r, width + 2 * r), dtype=bool)
+    centers[rows[inside], cols[inside]] = True
+    rows, cols = np.nonzero(centers)
+    if len(rows) == 0:
+        return
+    rows -= r
+    cols -= r
+
+    starts, ends = [], []
+    for dy in range(-r, r + 1):
+        half = int(np.floor(np.sqrt(radius * radius - dy * dy)))
+        row = rows + dy
+        inside = (row >= 0) & (row < height)
+        row = row[inside]
+        # runs are clipped to the grid; each row has one extra column for the run ends
+        start = np.clip(cols[inside] - half, 0, width)
+        end = np.clip(cols[inside] + half + 1, 0, width)
+        starts.append(row * (width + 1) + start)
+        ends.append(row * (width + 1) + end)
+
+    size = height * (width + 1)
+    counts = np.bincount(np.concatenate(starts), minlength=size) - np.bincount(np.concatenate(ends), minlength=size)
+    runs = np.cumsum(counts.reshape(height, width + 1), axis=1)[:, :width] > 0
+    grid |= runs
+
+
+class PathRaster(object):
+    """ boolean grid of the area covered by a path; origin is the top left corner [mm], scale in mm/pixel """
+    def __init__(self, origin, shape, scale=10, width=ROOMBA_WIDTH):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.scale = scale
+        self.width = width
+        self.grid = np.zeros(shape, dtype=bool)
+
+    @classmethod
+    def around(cls, points, scale=10, width=ROOMBA_WIDTH, margin=None):
+        """returns an empty raster that fits the points (in mm) plus margin (default: half the path width)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        margin = width / 2. if margin is None else margin
+        low = np.amin(points, axis=0) - margin
+        high = np.amax(points, axis=0) + margin
+        shape = (int(np.ceil((high[1] - low[1]) / scale)) + 1, int(np.ceil((high[0] - low[0]) / scale)) + 1)
+        return cls((low[0], high[1]), shape, scale, width)
+
+    def copy(self):
+        """returns a copy with its own grid"""
+        raster = PathRaster(self.origin, self.grid.shape, self.scale, self.width)
+        raster.grid[:] = self.grid
+        return raster
+
+    def to_pixels(self, points):
+        """returns rows and columns of points (in mm)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cols = np.floor((points[:, 0] - self.origin[0]) / self.scale).astype(np.int64)
+        rows = np.floor((self.origin[1] - points[:, 1]) / self.scale).astype(np.int64)
+        return rows, cols
+
+    def draw(self, points, width=None):
+        """draws a polyline (in mm) with the given width [mm] (default: width of the raster)"""
+        width = self.width if width is None else width
+        rows, cols = self.to_pixels(densify(points, self.scale / 2.))
+        stamp(self.grid, rows, cols, max(width / 2. / self.scale, 0.))
+        return self
+
+    def area(self):
+        """returns the covered area in m²"""
+        return np.count_nonzero(self.grid) * self.scale * self.scale / 1e6
+
+
+def rasterize(points, scale=10, width=ROOMBA_WIDTH, margin=None):
+    """returns a PathRaster with the path (points in mm) drawn in"""
+    return PathRaster.around(points, scale, width, margin).draw(points)
+
+
+def compose(masks, background):
+    """returns (indices, palette) of an image: background color, each (mask, color, alpha) blended on top in the
+    given order. Every combination of up to 8 masks gets its own palette entry, so blending is a table lookup."""
+    if len(masks) > 8:
+        raise ValueError("too many masks")
+    shape = masks[0][0].shape if masks else (1, 1)
+    indices = np.zeros(shape, dtype=np.uint8)
+    for bit, (mask, color, alpha) in enumerate(masks):
+        indices |= mask.astype(np.uint8) << bit
+
+    palette = np.empty((1 << len(masks), 3), dtype=np.float64)
+    palette[:] = to_rgb(background)
+    for bit, (mask, color, alpha) in enumerate(masks):
+        selected = (np.arange(len(palette)) >> bit) & 1 == 1
+        palette[selected] = palette[selected] * (1 - alpha) + np.asarray(to_rgb(color)) * alpha
+    return indices, np.rint(palette).astype(np.uint8)
+
+
+def colorize(masks, background):
+    """returns a RGB uint8 image: background color, each (mask, color, alpha) blended on top in the given order"""
+    indices, palette = compose(masks, background)
+    return palette[indices]
+
+
+def to_rgb(color):
+    """returns (r, g, b) of a color given as "#rrggbb" or tuple"""
+    if isinstance(color, str):
+        color = color.lstrip("#")
+        return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+    return tuple(color)
+
+
+def encode_png(image, palette=None, level=6):
+    """returns a PNG of a bool / uint8 image with 1 (gray), 3 (RGB) or 4 (RGBA) channels,
+    or of palette indices (see compose()) if a palette is given"""
+    image = np.asarray(image)
+    if image.dtype == bool:
+        image = image.astype(np.uint8) * 255
+    if image.ndim == 2:
+        image = image[:, :, None]
+    height, width, channels = image.shape
+    color_type = 3 if palette is not None else {1: 0, 3: 2, 4: 6}[channels]
+
+    # every row starts with filter type 0 (none)
+    rows = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    png = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+    if palette is not None:
+        png += chunk(b"PLTE", np.asarray(palette, dtype=np.uint8).tobytes())
+    return png + chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) + chunk(b"IEND", b"")
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+""" Streaming, crash-safe recorder for mission data.
+
+File layout (all little-endian):
+    header      HEADER_SIZE bytes: magic, version, sealed flag, record size, record count, index offset,
+                followed by a json list of [column name, struct format] (zero padded)
+    records     fixed-size records, one per sample, written in chunks. The records form one contiguous
+                block, so the file can be opened as memory-mapped numpy array (see open_recording()).
+    index       (sealed files only) one entry per chunk: first record, record count, first time, last time
+
+If the recorder was not sealed (e.g. after a crash) all complete records are still readable.
+"""
+
+import os
+import json
+import time
+import queue
+import struct
+import threading
+
+MAGIC = b"RMBAREC"
+VERSION = 1
+HEADER_SIZE = 256
+HEADER = struct.Struct("<7sBBxxxIQQ")     # magic, version, sealed, record size, record count, index offset
+INDEX_ENTRY = struct.Struct("<QQdd")      # first record, record count, first time, last time
+
+# columns of the recorded streams; the first column is always the time in seconds since epoch
+PATH_COLUMNS = [("t", "d"), ("x", "f"), ("y", "f"), ("theta", "f")]
+WIFI_COLUMNS = [("t", "d"), ("x", "f"), ("y", "f"), ("rssi", "f")]
+
+
+class MissionRecorder(object):
+    """ Append samples to a recording file. Samples are collected in fixed-size chunks that are written by a
+    background thread, so append() never blocks on disk i/o. Memory usage does not depend on the mission length.
+    """
+    def __init__(self, filename, columns, chunk_size=256, flush_interval=30):
+        self.filename = filename
+        self.columns = columns
+        self.record = struct.Struct("<" + "".join(fmt for _, fmt in columns))
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+
+        self.chunk = bytearray()
+        self.chunk_count = 0
+        self.chunk_first = None
+        self.chunk_last = None
+        self.last_flush = time.monotonic()
+        self.count = 0
+        self.sealed = False
+
+        self.file = open(self.filename, "wb")
+        self.file.write(self._header(False, 0, 0))
+        self.file.flush()
+
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _header(self, sealed, count, index_offset):
+        header = HEADER.pack(MAGIC, VERSION, 1 if sealed else 0, self.record.size, count, index_offset)
+        header += json.dumps(self.columns).encode("utf-8")
+        if len(header) > HEADER_SIZE:
+            raise ValueError("too many columns")
+        return header.ljust(HEADER_SIZE, b"\0")
+
+    def append(self, *values):
+        """add one sample; values must match the columns"""
+        self.chunk += self.record.pack(*values)
+        self.chunk_count += 1
+        if self.chunk_first is None:
+            self.chunk_first = values[0]
+        self.chunk_last = values[0]
+        self.count += 1
+
+        # slow streams (e.g. wifi signal) are written at least every flush_interval seconds
+        if self.chunk_count >= self.chunk_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """hand the current chunk over to the writer thread"""
+        if self.chunk_count:
+            self.queue.put((bytes(self.chunk), self.chunk_count, self.chunk_first, self.chunk_last))
+        self.chunk = bytearray()
+        self.chunk_count = 0
+        self.chunk_first = None
+        self.last_flush = time.monotonic()
+
+    def seal(self, wait=False):
+        """write remaining samples and the index and close the file; set wait=True to block until it is done"""
+        if self.sealed:
+            return
+        self.flush()
+        self.queue.put(None)
+        self.sealed = True
+        if wait:
+            self.writer.join()
+
+    def _write_loop(self):
+        index = []
+        records = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            data, count, first, last = item
+            self.file.write(data)
+            self.file.flush()
+            index.append(INDEX_ENTRY.pack(records, count, first, last))
+            records += count
+
+        # index goes after the records, then mark the file as sealed
+        index_offset = HEADER_SIZE + records * self.record.size
+        self.file.write(struct.pack("<Q", len(index)) + b"".join(index))
+        self.file.seek(0)
+        self.file.write(self._header(True, records, index_offset))
+        self.file.close()
+
+
+def read_header(filename):
+    """returns a dict with the header information of a recording"""
+    with open(filename, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+        magic, version, sealed, record_size, count, index_offset = HEADER.unpack_from(raw)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a mission recording".format(filename))
+        columns = json.loads(raw[HEADER.size:].rstrip(b"\0").decode("utf-8"))
+        index = []
+        if sealed:
+            f.seek(index_offset)
+            entries, = struct.unpack("<Q", f.read(8))
+            index = [INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size)) for _ in range(entries)]
+        else:
+            # not sealed: use all complete records
+            count = (os.path.getsize(filename) - HEADER_SIZE) // record_size
+    return {"sealed": bool(sealed), "record_size": record_size, "count": count, "columns": columns,
+            "data_offset": HEADER_SIZE, "index_offset": index_offset if sealed else None, "index": index}
+
+
+def open_recording(filename):
+    """returns the records of a recording as memory-mapped numpy record array (columns by name, e.g. rec["x"])"""
+    import numpy as np
+
+    header = read_header(filename)
+    dtype = np.dtype([(name, "<" + fmt) for name, fmt in header["columns"]])
+    if header["count"] == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", offset=header["data_offset"], shape=(header["count"],))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import numpy as np
+
+
+class SampleBuffer(object):
+    """ Growable column store for pose samples.
+    Every sample has a receive time "t" (time.monotonic() or time.time(), float64) and a position "xy" (robot units, float32),
+    plus any number of additional float32 columns (e.g. theta, rssi, snr). With theta that is 20 bytes per sample.
+    Capacity doubles when full, so append() is amortized O(1).
+
+    Columns are returned as numpy views without copying (buffer["theta"], buffer.xy). Views stay valid and unchanged
+    when the buffer grows or is cleared, as both allocate new arrays instead of modifying the old ones.
+    Arrays are only replaced while holding a lock, which snapshot() takes as well, so snapshots taken on another
+    thread are always consistent; append() itself does not lock.
+    """
+    def __init__(self, columns=("theta",), capacity=1024):
+        self.columns = tuple(columns)
+        self.length = 0
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    def _arrays(self, capacity):
+        return (np.empty(capacity, dtype=np.float64), np.empty((capacity, 2), dtype=np.float32),
+                {name: np.empty(capacity, dtype=np.float32) for name in self.columns})
+
+    def _allocate(self, capacity):
+        self._t, self._xy, self._columns = self._arrays(capacity)
+        self.capacity = capacity
+
+    def _grow(self):
+        # fill the new arrays before they replace the old ones, so readers never see uninitialized samples
+        n = self.length
+        t, xy, columns = self._arrays(self.capacity * 2)
+        t[:n] = self._t[:n]
+        xy[:n] = self._xy[:n]
+        for name in self.columns:
+            columns[name][:n] = self._columns[name][:n]
+        with self._lock:
+            self._t, self._xy, self._columns = t, xy, columns
+            self.capacity = len(t)
+
+    def append(self, t, x, y, **values):
+        """add a sample; additional columns are given by name, missing ones are stored as nan"""
+        if self.length == self.capacity:
+            self._grow()
+        n = self.length
+        self._t[n] = t
+        self._xy[n, 0] = x
+        self._xy[n, 1] = y
+        for name in self.columns:
+            self._columns[name][n] = values.get(name, np.nan)
+        # publish the new sample only after all columns have been written
+        self.length = n + 1
+
+    def clear(self, capacity=1024):
+        """remove all samples"""
+        # the length is reset first, so readers never slice the new (uninitialized) arrays with the old length
+        with self._lock:
+            self.length = 0
+            self._allocate(capacity)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def t(self):
+        return self._t[:self.length]
+
+    @property
+    def xy(self):
+        """positions as (n, 2) array"""
+        return self._xy[:self.length]
+
+    def __getitem__(self, name):
+        return self._columns[name][:self.length]
+
+    def snapshot(self):
+        """returns consistent views of all columns ("t", "xy" and the additional ones) without copying.
+        The length is read once, so all views end at the same sample even while another thread appends."""
+        with self._lock:
+            n = self.length
+            views = {"t": self._t[:n], "xy": self._xy[:n]}
+            views.update((name, column[:n]) for name, column in self._columns.items())
+        return views
+
+    def sample_size(self):
+        """returns the number of bytes used per sample"""
+        return self._t.itemsize + self._xy.itemsize * 2 + sum(column.itemsize for column in self._columns.values())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+""" Path simplification: removes positions that are (almost) on the line between their neighbours.
+
+With a tolerance of half a pixel of the output (see tolerance()) the simplified path renders the same as the
+original one, with a fraction of the vertices: the robot reports a position every few centimeters, mostly on
+straight lines.
+
+    rdp(points, tolerance)          Ramer-Douglas-Peucker for a whole path
+    radial(points, tolerance)       drops positions closer than tolerance to the last kept one (cheap prefilter)
+    StreamingSimplifier             simplifies while positions arrive
+"""
+
+import numpy as np
+
+
+def tolerance(scale):
+    """returns the tolerance [mm] that is invisible at scale [mm/pixel]"""
+    return scale / 2.
+
+
+def _distances(points, start, end):
+    """returns the distances of points to the line through start and end (to start if they are the same)"""
+    vector = end - start
+    length = np.hypot(vector[0], vector[1])
+    offsets = points - start
+    if length == 0:
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+    return np.abs(vector[0] * offsets[:, 1] - vector[1] * offsets[:, 0]) / length
+
+
+def rdp_mask(points, tolerance):
+    """returns a boolean mask of the positions kept by Ramer-Douglas-Peucker"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    # iterative, the distances of each range are computed at once
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+        distances = _distances(points[first + 1:last], points[first], points[last])
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            index += first + 1
+            keep[index] = True
+            ranges.append((first, index))
+            ranges.append((index, last))
+    return keep
+
+
+def rdp(points, tolerance):
+    """returns the positions kept by Ramer-Douglas-Peucker"""
+    points = np.asarray(points).reshape(-1, 2)
+    return points[rdp_mask(points, tolerance)]
+
+
+def radial(points, tolerance):
+    """returns the positions that are further than tolerance from the last kept one (first and last are kept)"""
+    points = np.asarray(points).reshape(-1, 2)
+    if len(points) < 3:
+        return points
+    keep = [0]
+    last = points[0]
+    # consecutive positions are close, so only check a window after the last kept position at once
+    index = 1
+    while index < len(points):
+        window = points[index:index + 256]
+        far = np.flatnonzero(np.hypot(window[:, 0] - last[0], window[:, 1] - last[1]) > tolerance)
+        if len(far) == 0:
+            index += len(window)
+            continue
+        index += int(far[0])
+        keep.append(index)
+        last = points[index]
+        index += 1
+    if keep[-1] != len(points) - 1:
+        keep.append(len(points) - 1)
+    return points[keep]
+
+
+class StreamingSimplifier(object):
+    """ Simplifies a path while positions arrive (opening window): a position is kept when one of the positions
+    since the last kept one is further than tolerance from the line between the last kept and the newest position.
+    vertices() always ends with the newest position, which is provisional: it moves on with the next positions.
+    The first final() vertices do not change anymore.
+    """
+    def __init__(self, tolerance, window=1024):
+        self.tolerance = tolerance
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.kept = []          # final vertices
+        self.pending = np.empty((self.window, 2), dtype=np.float64)    # positions since the last kept one
+        self.pending_count = 0
+        self.count = 0
+
+    def add(self, points):
+        """add new positions (n, 2)"""
+        for point in np.asarray(points, dtype=np.float64).reshape(-1, 2):
+            self.count += 1
+            if not self.kept:
+                self.kept.append(point)
+                continue
+            n = self.pending_count
+            if n and (n >= self.window or np.any(_distances(self.pending[:n], self.kept[-1], point) > self.tolerance)):
+                # the line to the new position would deviate too much: the last position becomes a vertex
+                self.kept.append(self.pending[n - 1].copy())
+                n = 0
+            self.pending[n] = point
+            self.pending_count = n + 1
+
+    def final(self):
+        """returns the number of vertices that are final"""
+        return len(self.kept)
+
+    def vertices(self):
+        """returns the simplified path"""
+        if self.pending_count:
+            return np.asarray(self.kept + [self.pending[self.pending_count - 1]])
+        return np.asarray(self.kept).reshape(-1, 2)
@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 
 # basic packages
+import sys
 import time
 import os
+import threading
 from datetime import datetime
 
 # mqtt stuff
@@ -16,6 +18,13 @@ from settings import settings
 import json
 import numpy as np
 
+# shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from recorder import MissionRecorder, PATH_COLUMNS, WIFI_COLUMNS
+from samples import SampleBuffer
+from catalog import Catalog
+import posecodec
+
 class MissionLogger(object):
     def __init__(self, settings):
         self.settings = settings
@@ -28,10 +37,12 @@ class MissionLogger(object):
         self.roomba_active = False
         self.roomba_pos = None
         self.roomba_signal = None
-        self.points = []
-        self.values = []
-        self.path = []
-        self.heading = []
+        self.path = SampleBuffer(("theta",))
+        self.wifi = SampleBuffer(("rssi",))
+
+        # streaming recorders of the current mission (format "rec" only)
+        self.path_recorder = None
+        self.wifi_recorder = None
 
         self.client.connect(self.settings["broker"]["host"], port=self.settings["broker"]["port"])
 
@@ -68,35 +79,88 @@ class MissionLogger(object):
                 data = json.loads(msg.payload)
                 if "point" in data:
                     self.roomba_pos = data["point"]
-                    self.path.append( [data["point"]["x"], data["point"]["y"]])
-                if "theta" in data:
-                    self.heading.append(data["theta"])
+                    if self.path_recorder:
+                        self.path_recorder.append(time.time(), data["point"]["x"], data["point"]["y"], data.get("theta", float("nan")))
+                    else:
+                        self.path.append(time.time(), data["point"]["x"], data["point"]["y"], theta=data.get("theta", float("nan")))
 
             if msg.topic.startswith(self.settings["topics"]["signal"]) and self.roomba_active:
                 self.debug(str(msg.topic) + ': ' + str(msg.payload), 3)
                 data = json.loads(msg.payload)
                 if "rssi" in data and self.roomba_pos:
-                    self.values.append(data["rssi"])
-                    self.points.append( [self.roomba_pos["x"], self.roomba_pos["y"]] )
+                    if self.wifi_recorder:
+                        self.wifi_recorder.append(time.time(), self.roomba_pos["x"], self.roomba_pos["y"], data["rssi"])
+                    else:
+                        self.wifi.append(time.time(), self.roomba_pos["x"], self.roomba_pos["y"], rssi=data["rssi"])
 
             if msg.topic.startswith(self.settings["topics"]["status"]):
                 self.debug(str(msg.topic) + ': ' + str(msg.payload), 3)
                 data = json.loads(msg.payload)
                 if "phase" in data:
-                    if self.roomba_active and (data["phase"] not in ["run", "hmPostMsn", "pause"]):
-                        self.debug("Captured path with {} positions.".format(len(self.path)), 2)
-                        temp_name = datetime.now().strftime("%Y-%m-%d_%H%M%S")
-                        np.savez(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_wifi.npz", points=self.points, values=self.values)
-                        np.savez(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_path.npz", points=self.path, values=self.heading)
+                    if not self.roomba_active and (data["phase"] in ["run", "hmPostMsn", "pause"]):
+                        self.start_mission()
 
-                        # delete captured data
-                        del self.points[:]
-                        del self.values[:]
-                        del self.path[:]
-                        del self.heading[:]
+                    if self.roomba_active and (data["phase"] not in ["run", "hmPostMsn", "pause"]):
+                        self.finish_mission()
 
                     self.roomba_active = (data["phase"] in ["run", "hmPostMsn", "pause"])
 
+    def start_mission(self):
+        """set up streaming recorders for a new mission"""
+        if self.settings.get("format", "npz") == "rec":
+            temp_name = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+            self.path_recorder = MissionRecorder(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_path.rec", PATH_COLUMNS)
+            self.wifi_recorder = MissionRecorder(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_wifi.rec", WIFI_COLUMNS)
+
+    def finish_mission(self):
+        """store captured data"""
+        if self.path_recorder:
+            # the recorders already wrote everything, just seal the files
+            self.debug("Captured path with {} positions.".format(self.path_recorder.count), 2)
+            self.path_recorder.seal()
+            self.wifi_recorder.seal()
+            self.update_catalog(self.path_recorder.filename, [self.path_recorder, self.wifi_recorder])
+            self.path_recorder = None
+            self.wifi_recorder = None
+            return
+
+        self.debug("Captured path with {} positions.".format(len(self.path)), 2)
+        temp_name = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        if self.settings.get("format", "npz") == "pose":
+            posecodec.save(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_wifi.pose", self.wifi.xy, self.wifi["rssi"], self.wifi.t)
+            posecodec.save(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_path.pose", self.path.xy, self.path["theta"], self.path.t)
+            self.update_catalog(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_path.pose")
+        else:
+            np.savez(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_wifi.npz", points=self.wifi.xy, values=self.wifi["rssi"], t=self.wifi.t)
+            np.savez(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_path.npz", points=self.path.xy, values=self.path["theta"], t=self.path.t)
+            self.update_catalog(os.path.dirname(os.path.abspath(__file__))+"/"+temp_name+"_path.npz")
+
+        # republish the whole path of the mission in compact form
+        if self.settings["topics"].get("path"):
+            self.client.publish(self.settings["topics"]["path"], posecodec.encode(self.path.xy, self.path["theta"], self.path.t), retain=True)
+
+        # delete captured data
+        self.wifi.clear()
+        self.path.clear()
+
+    def update_catalog(self, filename, recorders=()):
+        """add a finished mission to the catalog (in the background, as it has to wait for the recorders)"""
+        if not self.settings.get("catalog"):
+            return
+
+        def update():
+            for recorder in recorders:
+                recorder.writer.join()
+            try:
+                catalog = Catalog(os.path.join(os.path.dirname(os.path.abspath(__file__)), self.settings["catalog"]))
+                entry = catalog.add(filename)
+                catalog.close()
+                self.debug("Cataloged mission {}: {:.1f} m, {:.2f} m².".format(entry["name"], entry["length"], entry["area"]), 2)
+            except Exception as e:
+                self.debug("Could not catalog {}: {}".format(filename, e), 1)
+
+        threading.Thread(target=update, daemon=True).start()
+
     def loop(self):
         """main loop"""
         while True:
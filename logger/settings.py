@@ -1,5 +1,8 @@
 settings = {
         "debug": 2, # 0=None, 1=Error, 2=Info, 3=Trace
+        "format": "npz",    # npz: save mission at its end; rec: stream samples to disk while the mission runs (see common/recorder.py);
+                            # pose: save mission at its end in compact delta encoding (see common/posecodec.py)
+        "catalog": "missions.sqlite",   # sqlite index of all missions, relative to this directory (None to disable); see common/catalog.py
         "broker": {
             "host": "osmc",
             "port": 1883,
@@ -8,5 +11,6 @@ settings = {
             "pos": "home/roomba/state/pose",
             "signal": "home/roomba/state/signal",
             "status": "home/roomba/state/cleanMissionStatus",
+            "path": None,   # e.g. "home/roomba/state/lastpath": publish the path of the last mission (common/posecodec.py)
         },
     }
\ No newline at end of file
@@ -1,20 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Store recorded missions in the roombapath table of a postgres database.
+
+    python3 store.py 2018-08-05_191829_path.npz
+    python3 store.py /data/roomba "/data/archive/2019-*_path.npz" --workers 8 --batch-size 500
+
+Missions can be in any format supported by common/missions.py (npz, rec, cols).
+
+Files are decoded in a process pool and streamed to the database with COPY over a single connection, one
+transaction per batch. Missions that are already in the table (column "mission") are skipped, as well as further
+files of the same mission (e.g. x_path.npz and x_path.pose). Files that can not be decoded are reported and skipped.
+
+Migration: the column "mission" is added on the first run. Rows stored before have no mission name; they are
+matched to the missions found by their heading and number of positions and get the name of the mission instead of
+being stored again.
+"""
+
+import os
+import io
 import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import psycopg2 as pg
 
-if len(sys.argv) > 1:
-    npzfile = np.load(sys.argv[1])
-
-    points = npzfile["points"][:] * 11.8 / 1000 # convert to m
-    heading = npzfile["values"][:]
-
-    if len(points) > 20:
-        with pg.connect("dbname='home' user='postgres' host='omv4' password='postgres'") as con:
-            with con.cursor() as cur:
-                translator = str.maketrans('[]','()')
-                path = np.array2string(points, precision=3, separator=',', suppress_small=True)[1:-1]
-                path = "["+path.translate(translator)+"]"  # must look like this: '[(11,54), (31,32), (0,0)]'
-                cur.execute("INSERT INTO public.roombapath (heading, path) VALUES(%s, popen(path %s))", (heading.tolist(), path))
-                print("done")
-    else:
-        print("Path too short.")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from catalog import mission_name
+from missions import load_mission, find_missions
+
+DSN = "dbname='home' user='postgres' host='omv4' password='postgres'"
+
+
+def encode_mission(filename, min_points=20):
+    """returns (mission, filename, COPY row, heading literal, number of positions) of a mission file; the row is None
+    if the path is too short, the error message instead of the heading if the file can not be decoded"""
+    mission = mission_name(filename)
+    try:
+        return encode_path(mission, filename, min_points)
+    except Exception as e:
+        return mission, filename, None, "{}: {}".format(type(e).__name__, e), 0
+
+
+def encode_path(mission, filename, min_points):
+    data = load_mission(filename)
+    if len(data) <= min_points:
+        return mission, filename, None, None, len(data)
+
+    points = data.points() / 1000     # convert to m
+    heading = np.asarray(data["values"])
+
+    # format the numbers once and join them into the literals: '{1.5,2.5}' and '[(11.0,54.0),(31.0,32.0)]'
+    coordinates = np.char.mod("%.3f", points.reshape(-1, 2))
+    path = "[(" + "),(".join(np.char.add(np.char.add(coordinates[:, 0], ","), coordinates[:, 1])) + ")]"
+    heading = "{" + ",".join(np.char.mod("%.17g", heading.astype(np.float64))) + "}"
+    return mission, filename, "\t".join([mission, heading, path]) + "\n", heading, len(points)
+
+
+class Store(object):
+    """ single connection to the database, rows are written with COPY in batches """
+    def __init__(self, dsn, batch_size=100):
+        self.con = pg.connect(dsn)
+        self.batch_size = batch_size
+        self.batch = io.StringIO()
+        self.pending = 0
+        self.stored = 0
+
+        with self.con, self.con.cursor() as cur:
+            cur.execute("ALTER TABLE public.roombapath ADD COLUMN IF NOT EXISTS mission text")
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS roombapath_mission ON public.roombapath (mission)")
+
+    def ingested(self):
+        """returns the names of all missions already in the table"""
+        with self.con, self.con.cursor() as cur:
+            cur.execute("SELECT mission FROM public.roombapath WHERE mission IS NOT NULL")
+            return set(row[0] for row in cur)
+
+    def legacy(self):
+        """returns the number of rows without mission name (stored before the column was added)"""
+        with self.con, self.con.cursor() as cur:
+            cur.execute("SELECT count(*) FROM public.roombapath WHERE mission IS NULL")
+            return cur.fetchone()[0]
+
+    def claim(self, mission, heading, count):
+        """names a row without mission name that holds this mission; returns True if there was one"""
+        with self.con, self.con.cursor() as cur:
+            cur.execute("UPDATE public.roombapath SET mission = %s WHERE ctid = (SELECT ctid FROM public.roombapath "
+                        "WHERE mission IS NULL AND npoints(path) = %s AND heading::float8[] = %s::float8[] LIMIT 1)",
+                        (mission, count, heading))
+            return cur.rowcount > 0
+
+    def add(self, row):
+        self.batch.write(row)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        if self.pending:
+            self.batch.seek(0)
+            with self.con, self.con.cursor() as cur:
+                cur.copy_expert("COPY public.roombapath (mission, heading, path) FROM STDIN", self.batch)
+            self.stored += self.pending
+        self.batch = io.StringIO()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.con.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="store roomba missions in postgres")
+    parser.add_argument("paths", nargs="+", help="mission files, directories or glob patterns")
+    parser.add_argument("--dsn", default=DSN)
+    parser.add_argument("--batch-size", type=int, default=100, help="missions per transaction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes decoding the files")
+    parser.add_argument("--min-points", type=int, default=20, help="skip shorter paths")
+    args = parser.parse_args()
+
+    store = Store(args.dsn, args.batch_size)
+    ingested = store.ingested()
+    legacy = store.legacy()
+    found = find_missions(args.paths)
+
+    # one file per mission, the unique index would fail the whole batch otherwise
+    filenames = []
+    for filename in found:
+        mission = mission_name(filename)
+        if mission not in ingested:
+            filenames.append(filename)
+            ingested.add(mission)
+
+    skipped = failed = claimed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for mission, filename, row, heading, count in pool.map(encode_mission, filenames, [args.min_points] * len(filenames), chunksize=16):
+            if row is None and heading is not None:
+                print("{}: {}".format(filename, heading))
+                failed += 1
+            elif row is None:
+                print("{}: path too short.".format(filename))
+                skipped += 1
+            elif legacy > claimed and store.claim(mission, heading, count):
+                claimed += 1
+            else:
+                store.add(row)
+    store.close()
+    print("done: stored {}, skipped {} short, {} failed, {} named and {} already stored missions".format(
+        store.stored, skipped, failed, claimed, len(found) - len(filenames)))
@@ -3,7 +3,13 @@
 
 # basic packages
 import io
+import os
+import sys
 import time
+import struct
+import hashlib
+import threading
+import collections
 from datetime import datetime
 
 # mqtt stuff
@@ -21,11 +27,525 @@ import matplotlib
 # Force matplotlib to NOT use any Xwindows backend.
 matplotlib.use('Agg')
 
-from matplotlib import ticker, pyplot as plt
+from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
 from scipy.interpolate import griddata
 
+# shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from samples import SampleBuffer
+from raster import PathRaster, stamp, compose, encode_png, densify
+import posecodec
+import simplify
+
 # width of vacuum opening
 ROOMBA_WIDTH = 180
+# limits grow in steps of this size [mm], so the view is not rescaled on every new position
+LIMIT_STEP = 500
+# header of the path stream: sequence number, index of the first position
+STREAM_HEADER = struct.Struct("<II")
+
+
+def grow_limits(limits, points, drawn=0):
+    """returns the limits (low, high) [mm] grown in steps of LIMIT_STEP so they hold the path (with the width of the
+    vacuum unit), or None if the current limits already do. Limits only grow, so only the positions from drawn - 1 on
+    are checked."""
+    if limits is not None and len(points) >= drawn:
+        points = points[max(drawn - 1, 0):]
+    low = np.amin(points, axis=0) - ROOMBA_WIDTH
+    high = np.amax(points, axis=0) + ROOMBA_WIDTH
+    if limits is not None and np.all(low >= limits[0]) and np.all(high <= limits[1]):
+        return None
+    low = np.floor(low / LIMIT_STEP) * LIMIT_STEP
+    high = np.ceil(high / LIMIT_STEP) * LIMIT_STEP
+    if limits is not None:
+        low = np.minimum(low, limits[0])
+        high = np.maximum(high, limits[1])
+    return low, high
+
+
+def grid_mask(shape, scale):
+    """returns the dotted grid with LIMIT_STEP spacing of a raster whose top left pixel is on a grid line"""
+    grid = np.zeros(shape, dtype=bool)
+    step = int(LIMIT_STEP / scale)
+    grid[::step, ::4] = grid[::step, 1::4] = True
+    grid[::4, ::step] = grid[1::4, ::step] = True
+    return grid
+
+
+def compose_map(area, line, grid, markers=()):
+    """returns the palette image of the rasterized layers, in the colors of PathRenderer; markers are (mask, color)
+    drawn on top"""
+    layers = [(area, "#4682b4", .9), (line, "#ffffff", .5), (grid, "#b0b0b0", .5)]
+    return compose(layers + [(mask, color, .5) for mask, color in markers], "#065da2")
+
+
+class PathRenderer(object):
+    """ Renders the live path into one persistent figure.
+    Everything that was drawn is kept as background image; new positions are drawn on top of it, so the cost of a
+    frame does not depend on the length of the path. Only when the path leaves the current view the limits (and
+    the data-unit linewidth) are updated and the whole figure is drawn again.
+
+    Incremental frames must look the same as a full redraw, so the layers are kept apart: the area (opaque, so
+    overlapping pieces blend the same as one line) is drawn into the figure, the path into a second figure that only
+    holds its coverage, which is blended on top of the area in every frame. The grid and the markers are drawn on top
+    of that in every frame and are never part of a background.
+    """
+    def __init__(self, size=(1000, 800)):
+        self.fig = plt.figure(figsize=(size[0]/100., size[1]/100.), dpi=100)
+        self.ax = self._axes(self.fig)
+        ax = self.ax
+
+        # set background colors
+        self.fig.patch.set_facecolor('#065da2')
+        ax.set_facecolor('#065da2')
+
+        # dotted grid with 0.5m spacing, see _update_limits()
+        self.grid = LineCollection([], linestyles="dotted", linewidths=1, colors=matplotlib.rcParams["grid.color"],
+                                                   alpha=.5, animated=True)
+        ax.add_collection(self.grid)
+
+        # path with respect to width of vacuum unit (e.g. 180mm); steelblue with alpha .9 on the background as
+        # opaque color. The "new" line only holds the positions since the last frame
+        area_color = .9 * np.array(matplotlib.colors.to_rgb("steelblue")) + .1 * np.array(matplotlib.colors.to_rgb("#065da2"))
+        style_area = dict(color=area_color, solid_capstyle="butt")
+        self.area, = ax.plot([], [], '-', **style_area)
+        self.new_area, = ax.plot([], [], '-', animated=True, **style_area)
+
+        # path (position samples): white on black, the red channel is the coverage
+        self.line_fig = Figure(figsize=(size[0]/100., size[1]/100.), dpi=100)
+        FigureCanvasAgg(self.line_fig)
+        self.line_fig.patch.set_facecolor('black')
+        self.line_ax = self._axes(self.line_fig)
+        self.line_ax.set_facecolor('black')
+        style_path = dict(color="white", markersize=2, linewidth=.75)
+        self.line, = self.line_ax.plot([], [], '-', **style_path)
+        self.new_line, = self.line_ax.plot([], [], '-', animated=True, **style_path)
+
+        # start and end position
+        self.start_pos = plt.Circle((0, 0), 100, color='white', linewidth=2, alpha=.5, zorder=100, animated=True)
+        ax.add_artist(self.start_pos)
+        self.final_pos = plt.Circle((0, 0), 100, color='lime', linewidth=2, alpha=.5, zorder=101, animated=True)
+        ax.add_artist(self.final_pos)
+
+        self.reset()
+
+    @staticmethod
+    def _axes(fig):
+        """adds axes that fill the figure, without ticks and spines"""
+        ax = fig.add_axes([0., 0., 1., 1.])
+        ax.set_aspect('equal')
+
+        # all off
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_visible(False)
+        ax.spines['left'].set_visible(False)
+
+        ax.tick_params(top=False, bottom=False, left=False, right=False, labelleft=False, labelbottom=False)
+        return ax
+
+    def reset(self):
+        """start a new path"""
+        self.limits = None
+        self.drawn = 0
+        self.background = None
+        self.line_background = None
+
+    def _draw_new(self, points, first):
+        """draws the segments from position first on"""
+        if len(points) - first > 1:
+            # the area starts one segment earlier, so the join at first is drawn as in a full redraw (it is opaque, so
+            # drawing the segment twice does not change it)
+            area = points[max(first - 1, 0):]
+            line = points[first:]
+            self.new_area.set_data(area[:,0], area[:,1])
+            self.new_line.set_data(line[:,0], line[:,1])
+            self.ax.draw_artist(self.new_area)
+            self.line_ax.draw_artist(self.new_line)
+
+    def _update_limits(self, points):
+        """grows the limits if the path left the view; returns True if they changed"""
+        limits = grow_limits(self.limits, points, self.drawn)
+        if limits is None:
+            return False
+        self.limits = limits
+        low, high = limits
+        for ax in (self.ax, self.line_ax):
+            ax.set_xlim(low[0], high[0])
+            ax.set_ylim(low[1], high[1])
+            ax.apply_aspect()
+
+        # grid lines across the visible area (the aspect ratio may show more than the limits)
+        (x0, x1), (y0, y1) = self.ax.get_xlim(), self.ax.get_ylim()
+        xs = np.arange(np.ceil(x0 / LIMIT_STEP), np.floor(x1 / LIMIT_STEP) + 1) * LIMIT_STEP
+        ys = np.arange(np.ceil(y0 / LIMIT_STEP), np.floor(y1 / LIMIT_STEP) + 1) * LIMIT_STEP
+        self.grid.set_segments([[(x, y0), (x, y1)] for x in xs] + [[(x0, y), (x1, y)] for y in ys])
+
+        # linewidth in points for ROOMBA_WIDTH in data units; the transformation is valid after apply_aspect()
+        lw = ((self.ax.transData.transform((1, ROOMBA_WIDTH))-self.ax.transData.transform((0, 0)))*(72./self.fig.dpi))[1]
+        self.area.set_linewidth(lw)
+        self.new_area.set_linewidth(lw)
+        return True
+
+    def render(self, points, final=None):
+        """returns the path (in mm) as RGB image. Only the first final positions (default: all) are final; the
+        segments after them may still change (see StreamingSimplifier), so they are drawn into this frame only."""
+        final = len(points) if final is None else min(max(final, 1), len(points))
+        canvas, line_canvas = self.fig.canvas, self.line_fig.canvas
+        if self._update_limits(points) or self.background is None or final < self.drawn:
+            # full redraw
+            done = points[:final]
+            self.area.set_data(done[:,0], done[:,1])
+            self.line.set_data(done[:,0], done[:,1])
+            canvas.draw()
+            line_canvas.draw()
+        else:
+            # draw the new part of the path on top of the last frame
+            canvas.restore_region(self.background)
+            line_canvas.restore_region(self.line_background)
+            self._draw_new(points[:final], max(self.drawn - 1, 0))
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
+        self.line_background = line_canvas.copy_from_bbox(self.line_fig.bbox)
+        self.drawn = final
+
+        # the provisional part is not part of the background
+        self._draw_new(points, final - 1)
+
+        # path in white with alpha .5, weighted by its coverage (only the few covered pixels are touched)
+        image = np.asarray(canvas.buffer_rgba())
+        coverage = np.asarray(line_canvas.buffer_rgba())[:, :, 0]
+        covered = np.nonzero(coverage)
+        pixels = image[covered][:, :3].astype(np.int32)
+        weights = coverage[covered].astype(np.int32)[:, None]
+        image[covered[0], covered[1], :3] = pixels + ((255 - pixels) * weights + 255) // 510
+
+        # grid and markers are not part of the background
+        self.start_pos.center = points[0]
+        self.final_pos.center = points[-1]
+        self.ax.draw_artist(self.grid)
+        self.ax.draw_artist(self.start_pos)
+        self.ax.draw_artist(self.final_pos)
+
+        # the canvas buffer is reused for the next frame
+        return np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+
+
+class RasterPathRenderer(object):
+    """ Renders the live path with the numpy rasterizer (common/raster.py) instead of matplotlib.
+    The covered area is drawn incrementally into a persistent raster; only when the path leaves the raster, it is
+    allocated anew (limits grow like in PathRenderer) and the whole path is drawn again.
+    """
+    def __init__(self, scale=10):
+        self.scale = scale
+        self.reset()
+
+    def reset(self):
+        """start a new path"""
+        self.limits = None
+        self.drawn = 0
+        self.area = None
+        self.line = None
+
+    def _update_limits(self, points):
+        """grows the limits if the path left the raster; returns True if they changed"""
+        limits = grow_limits(self.limits, points, self.drawn)
+        if limits is None:
+            return False
+        self.limits = limits
+        low, high = limits
+
+        shape = (int((high[1] - low[1]) / self.scale), int((high[0] - low[0]) / self.scale))
+        self.area = PathRaster((low[0], high[1]), shape, self.scale, ROOMBA_WIDTH)
+        self.line = PathRaster((low[0], high[1]), shape, self.scale, 0)
+
+        self.grid = grid_mask(shape, self.scale)
+        return True
+
+    def render(self, points, final=None):
+        """returns the path (in mm) as RGB image. Only the first final positions (default: all) are drawn into the
+        persistent raster, the segments after them (which may still change) into a copy for this frame."""
+        final = len(points) if final is None else min(max(final, 1), len(points))
+        if self._update_limits(points) or final < self.drawn:
+            new = points[:final]
+        else:
+            new = points[max(self.drawn - 1, 0):final]
+        self.area.draw(new)
+        self.line.draw(new)
+        self.drawn = final
+
+        area, line = self.area, self.line
+        if final < len(points):
+            area = self.area.copy().draw(points[final - 1:])
+            line = self.line.copy().draw(points[final - 1:])
+
+        # start and end position
+        start_pos = np.zeros(self.area.grid.shape, dtype=bool)
+        final_pos = np.zeros(self.area.grid.shape, dtype=bool)
+        for marker, point in [(start_pos, points[0]), (final_pos, points[-1])]:
+            rows, cols = self.area.to_pixels(point)
+            stamp(marker, rows, cols, 100. / self.scale)
+
+        indices, palette = compose_map(area.grid, line.grid, self.grid, [(start_pos, "#ffffff"), (final_pos, "#00ff00")])
+        return palette[indices]
+
+
+def touched_tiles(points, size, radius=ROOMBA_WIDTH / 2.):
+    """returns the tiles (tx, ty) of the given size [mm] that a path (points in mm) of the given radius touches;
+    tile (0, 0) covers x and y in [0, size)"""
+    # every position on the path is within step / 2 of a sample, so the squares of margin around the samples cover
+    # the whole path; a square is probed at its corners (and in between if it is larger than a tile)
+    step = max(radius, 1.)
+    samples = densify(points, step)
+    margin = radius + step / 2.
+    offsets = np.linspace(-margin, margin, int(np.ceil(2 * margin / size)) + 1)
+    touched = set()
+    for dx in offsets:
+        for dy in offsets:
+            tiles = np.floor((samples + (dx, dy)) / size).astype(np.int64)
+            touched.update(map(tuple, np.unique(tiles, axis=0).tolist()))
+    return touched
+
+
+class TiledMap(object):
+    """ Live map split into square tiles of a fixed size in world coordinates (tile (0, 0) covers x and y in
+    [0, size) mm). Only the tiles touched by new positions are drawn and encoded again; every tile has a version that
+    is increased when it changes, so clients only have to fetch changed tiles.
+    """
+    def __init__(self, size=2000, scale=10):
+        self.size = size
+        self.scale = scale
+        self.pixels = int(size / scale)
+        self.reset()
+
+        # the grid is the same for every tile, as the tile size is a multiple of its spacing
+        self.grid = grid_mask((self.pixels, self.pixels), scale)
+
+    def reset(self):
+        """start a new path"""
+        self.tiles = {}     # (tx, ty) -> (area raster, path raster)
+        self.versions = {}  # (tx, ty) -> version
+        self.drawn = 0
+
+    def update(self, points):
+        """draws the positions (in mm) added since the last call; returns {(tx, ty): png} of the changed tiles"""
+        if len(points) <= self.drawn:
+            return {}
+        new = points[max(self.drawn - 1, 0):]
+        self.drawn = len(points)
+
+        # tiles touched by the new segments (including the width of the vacuum unit)
+        changed = {}
+        for tile in sorted(touched_tiles(new, self.size)):
+            if tile not in self.tiles:
+                origin = (tile[0] * self.size, (tile[1] + 1) * self.size)
+                shape = (self.pixels, self.pixels)
+                self.tiles[tile] = (PathRaster(origin, shape, self.scale, ROOMBA_WIDTH), PathRaster(origin, shape, self.scale, 0))
+            area, line = self.tiles[tile]
+            area.draw(new)
+            line.draw(new)
+            self.versions[tile] = self.versions.get(tile, 0) + 1
+            indices, palette = compose_map(area.grid, line.grid, self.grid)
+            changed[tile] = encode_png(indices, palette)
+        return changed
+
+    def manifest(self, position=None):
+        """returns the description of the map: tile size, versions of all tiles and the current position (in mm)"""
+        return {"size": self.size, "scale": self.scale, "position": position,
+                "tiles": {"{}_{}".format(*tile): version for tile, version in sorted(self.versions.items())}}
+
+
+class PathStream(object):
+    """ The path as stream of binary messages, so clients can render it themselves.
+    Every message is STREAM_HEADER (sequence number, index of its first position) followed by the positions (robot
+    units) and headings encoded with common/posecodec.py. Batches hold the positions since the last batch; snapshots
+    hold the whole path (first index 0) for clients that join late. A client takes the latest snapshot and appends
+    the batches with a higher sequence number; on a gap it waits for the next snapshot.
+    """
+    def __init__(self):
+        self.seq = 0
+        self.reset()
+
+    def reset(self):
+        """start a new path"""
+        self.sent = 0
+
+    def batch(self, points, values):
+        """returns a message with the positions added since the last batch, None if there are none"""
+        if len(points) <= self.sent:
+            return None
+        first = self.sent
+        self.sent = len(points)
+        self.seq += 1
+        return STREAM_HEADER.pack(self.seq, first) + posecodec.encode(points[first:], values[first:])
+
+    def snapshot(self, points, values):
+        """returns a message with the whole path up to the last batch"""
+        return STREAM_HEADER.pack(self.seq, 0) + posecodec.encode(points[:self.sent], values[:self.sent])
+
+
+class RenderWorker(threading.Thread):
+    """ Renders and publishes the live path on its own thread, so message ingestion is never blocked.
+    Jobs work on snapshots of the sample buffer (views up to a length watermark, see SampleBuffer.snapshot()), which
+    stay valid and unchanged while new samples are appended or the buffer is cleared. Jobs run in order; a frame that
+    is still queued when the next one is submitted is replaced by it.
+    """
+    def __init__(self, logger):
+        super().__init__(daemon=True)
+        self.logger = logger
+        self.jobs = collections.deque()
+        self.condition = threading.Condition()
+
+        self.rendered = 0
+        self.skipped = 0
+        self.max_depth = 0
+        self.latency = 0.
+        self.max_latency = 0.
+        self.render_time = 0.
+        self.max_render_time = 0.
+
+    def submit(self, kind, snapshot=None, **options):
+        """queue a job: "frame" (options draw, stream, stream_snapshot) or "reset" """
+        with self.condition:
+            if kind == "frame" and self.jobs and self.jobs[-1][0] == "frame":
+                # the worker did not get to the last frame yet: render the newer snapshot instead
+                _, _, _, pending = self.jobs.pop()
+                options = {key: options.get(key, False) or pending.get(key, False) for key in set(options) | set(pending)}
+                self.skipped += 1
+            self.jobs.append((kind, time.monotonic(), snapshot, options))
+            self.max_depth = max(self.max_depth, len(self.jobs))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs:
+                    self.condition.wait()
+                kind, submitted, snapshot, options = self.jobs.popleft()
+
+            start = time.monotonic()
+            try:
+                if kind == "reset":
+                    self.logger.resetRendering()
+                else:
+                    self.logger.renderFrame(snapshot, **options)
+            except Exception as e:
+                self.logger.debug("Rendering failed: {}".format(e), 1)
+            end = time.monotonic()
+
+            if kind == "frame":
+                self.rendered += 1
+                self.render_time = end - start
+                self.max_render_time = max(self.max_render_time, self.render_time)
+                self.latency = end - submitted
+                self.max_latency = max(self.max_latency, self.latency)
+                self.logger.publishStats(self.stats())
+
+    def stats(self):
+        with self.condition:
+            depth = len(self.jobs)
+        return {"rendered": self.rendered, "skipped": self.skipped, "queue": depth, "max_queue": self.max_depth,
+                "render_time": round(self.render_time, 4), "max_render_time": round(self.max_render_time, 4),
+                "latency": round(self.latency, 4), "max_latency": round(self.max_latency, 4)}
+
+
+class CoverageStats(object):
+    """ Statistics of the running mission, updated with the new positions only: covered area (occupancy raster of
+    cell mm, split into chunks so it never has to be reallocated), distance, overlap and mean speed.
+    Overlap is the fraction of the swept area (distance * ROOMBA_WIDTH) that was already covered before.
+    """
+    CHUNK = 256     # cells per chunk side
+
+    def __init__(self, cell=20):
+        self.cell = cell
+        self.reset()
+
+    def reset(self):
+        self.chunks = {}    # (cx, cy) -> PathRaster
+        self.cells = 0      # covered cells
+        self.distance = 0.  # [mm]
+        self.count = 0      # positions processed
+        self.start = None
+        self.last = None
+        self.last_point = None
+
+    def update(self, new, t):
+        """add the positions (in mm) and receive times since the last update (the samples from index count on)"""
+        if len(new) == 0:
+            return
+        if self.start is None:
+            self.start = t[0]
+        self.last = t[-1]
+        self.count += len(new)
+
+        # continue from the last position of the previous update
+        if self.last_point is not None:
+            new = np.vstack([self.last_point, new])
+        self.last_point = new[-1]
+        vectors = np.diff(new, axis=0)
+        self.distance += float(np.sum(np.hypot(vectors[:, 0], vectors[:, 1])))
+
+        size = self.CHUNK * self.cell
+        for chunk in touched_tiles(new, size):
+            if chunk not in self.chunks:
+                self.chunks[chunk] = PathRaster((chunk[0] * size, (chunk[1] + 1) * size), (self.CHUNK, self.CHUNK), self.cell, ROOMBA_WIDTH)
+            raster = self.chunks[chunk]
+            before = int(np.count_nonzero(raster.grid))
+            raster.draw(new)
+            self.cells += int(np.count_nonzero(raster.grid)) - before
+
+    def stats(self):
+        area = self.cells * self.cell * self.cell / 1e6
+        swept = self.distance * ROOMBA_WIDTH / 1e6
+        duration = float(self.last - self.start) if self.start is not None else 0.
+        return {"area": round(area, 2),                                            # [m²]
+                "distance": round(self.distance / 1000, 2),                        # [m]
+                "overlap": round(max(0., 1 - area / swept), 3) if swept else 0.,
+                "speed": round(self.distance / 1000 / duration, 3) if duration else 0.,  # [m/s]
+                "duration": round(duration, 1)}                                    # [s]
+
+
+class FrameOutputs(object):
+    """ Derives the published images from the rendered frame: every output has its own topic, width (downscaled
+    from the frame, None=full size) and format ("png" with "level", "jpeg" or "webp" with "quality").
+    Frames with the same content as the last one are detected by hash and not published again.
+    """
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.reset()
+
+    def reset(self):
+        self.digest = None
+        self.last = {}  # topic -> last published image
+
+    def encode(self, image):
+        """returns {topic: image data} for a RGB frame, empty if the frame did not change"""
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+        if digest == self.digest:
+            return {}
+        self.digest = digest
+
+        frame = Image.fromarray(image)
+        encoded = {}
+        for output in self.outputs:
+            variant = frame
+            if output.get("width") and output["width"] < frame.width:
+                height = max(1, round(frame.height * output["width"] / frame.width))
+                # reduce by an integer factor first (cheap box filter), then resample the rest
+                variant = frame.resize((output["width"], height), Image.BILINEAR, reducing_gap=2.)
+            buffer = io.BytesIO()
+            format = output.get("format", "png")
+            if format == "png":
+                variant.save(buffer, format="png", compress_level=output.get("level", 6))
+            else:
+                variant.save(buffer, format=format, quality=output.get("quality", 80))
+            encoded[output["topic"]] = buffer.getvalue()
+        self.last = encoded
+        return encoded
+
 
 class MissionLogger(object):
     def __init__(self, settings):
@@ -39,8 +559,28 @@ class MissionLogger(object):
         self.roomba_active = False
         self.roomba_pos = None
         self.roomba_signal = None
-        self.path = []
-        self.heading = []
+        self.path = SampleBuffer(("theta",))
+        self.mission = 0    # increased when the path is cleared
+        self.changed = threading.Event()    # new positions, a new mission or a frame request
+        self.requested = False
+        self.last_drawn = 0
+        self.outputs = FrameOutputs(self.settings.get("outputs") or [{"topic": self.settings["topics"]["livepath"]}])
+        if self.settings.get("renderer", "matplotlib") == "raster":
+            self.renderer = RasterPathRenderer(self.settings.get("scale", 10))
+        else:
+            self.renderer = PathRenderer(self.settings.get("size", (1000, 800)))
+        self.stream = PathStream() if self.settings.get("stream", {}).get("enabled") else None
+        self.tiles = None
+        if self.settings.get("tiles", {}).get("enabled"):
+            self.tiles = TiledMap(self.settings["tiles"]["size"], self.settings.get("scale", 10))
+        self.coverage = None
+        if self.settings.get("coverage", {}).get("enabled"):
+            self.coverage = CoverageStats(self.settings["coverage"]["cell"])
+        self.simplifier = None
+        if self.settings.get("simplify"):
+            self.simplifier = simplify.StreamingSimplifier(simplify.tolerance(self.settings.get("scale", 10)))
+        self.worker = RenderWorker(self)
+        self.worker.start()
 
         self.client.connect(self.settings["broker"]["host"], port=self.settings["broker"]["port"])
 
@@ -65,6 +605,8 @@ class MissionLogger(object):
         # subscribe to relevant topics 
         client.subscribe(self.settings["topics"]["pos"])    # position 
         client.subscribe(self.settings["topics"]["status"])  # cleaning status
+        if self.settings["topics"].get("livepath_request"):
+            client.subscribe(self.settings["topics"]["livepath_request"])   # frame requests of dashboards
 
     def on_message(self, client, userdata, msg):
         """The callback for when a PUBLISH message is received from the server."""
@@ -76,9 +618,12 @@ class MissionLogger(object):
                 data = json.loads(msg.payload)
                 if "point" in data:
                     self.roomba_pos = data["point"]
-                    self.path.append( [data["point"]["x"], data["point"]["y"]])
-                if "theta" in data:
-                    self.heading.append(data["theta"])
+                    self.path.append(time.monotonic(), data["point"]["x"], data["point"]["y"], theta=data.get("theta", np.nan))
+                    self.changed.set()
+
+            if self.settings["topics"].get("livepath_request") and msg.topic == self.settings["topics"]["livepath_request"]:
+                self.requested = True
+                self.changed.set()
 
             if msg.topic.startswith(self.settings["topics"]["status"]):
                 self.debug(str(msg.topic) + ': ' + str(msg.payload), 3)
@@ -87,81 +632,157 @@ class MissionLogger(object):
                     if self.roomba_active and (data["phase"] not in ["run", "hmPostMsn", "pause"]):
                         self.debug("Captured path with {} positions.".format(len(self.path)), 2)
 
-                        # delete captured data
-                        del self.path[:]
-                        del self.heading[:]
+                        # delete captured data; renderers are reset by the worker after pending frames
+                        self.path.clear()
+                        self.mission += 1
+                        self.worker.submit("reset")
+                        self.changed.set()
 
                     self.roomba_active = (data["phase"] in ["run", "hmPostMsn", "pause"])
 
-    def drawPath(self):
-        points = np.array(self.path) * 11.8  # convert to mm
-        values = np.array(self.heading)
-
-        minx=np.amin(points, axis=0)[0]
-        maxx=np.amax(points, axis=0)[0]
-
-        miny=np.amin(points, axis=0)[1]
-        maxy=np.amax(points, axis=0)[1]
-
-        fig = plt.figure(figsize=(10,8), dpi=100)
-        ax = plt.Axes(fig, [0., 0., 1., 1.])
-        fig.add_axes(ax)    
-
-        ax.set_aspect('equal')
-
-        ax.set_xlim(minx-ROOMBA_WIDTH, maxx+ROOMBA_WIDTH)
-        ax.set_ylim(miny-ROOMBA_WIDTH, maxy+ROOMBA_WIDTH)
-
-        # set background colors
-        fig.patch.set_facecolor('#065da2')
-        ax.set_facecolor('#065da2')
-
-        # setup grid
-        ax.grid(which="both", linestyle="dotted", linewidth=1, alpha=.5, zorder=5)
-
-        # spacing 0.5m
-        ax.xaxis.set_major_locator(ticker.MultipleLocator(500))
-        ax.yaxis.set_major_locator(ticker.MultipleLocator(500))
-
-        # all off
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-
-        plt.tick_params(top=False, bottom=False, left=False, right=False, labelleft=False, labelbottom=False)
-
-        # call this before any transformations. reason is unknown
-        fig.canvas.draw()   
-
-        lw = ((ax.transData.transform((1, ROOMBA_WIDTH))-ax.transData.transform((0, 0)))*(72./fig.dpi))[1]
-        plt.plot(points[:,0], points[:,1], '-', color="steelblue", linewidth=lw, alpha=.9, solid_capstyle="butt")
-
-        # plot path (and position samples)
-        plt.plot(points[:,0], points[:,1], '-', color="white", markersize=2, linewidth=.75, alpha=.5)
-
-        # plot start and end position 
-        start_pos = plt.Circle((points[0,0], points[0,1]), 100, color='white', linewidth=2, alpha=.5, zorder=100)
-        ax.add_artist(start_pos)
-
-        final_pos = plt.Circle((points[-1,0], points[-1,1]), 100, color='lime', linewidth=2, alpha=.5, zorder=101)
-        ax.add_artist(final_pos)
-
-        # use in-memory file to save plot
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format="png", dpi=100, facecolor=fig.get_facecolor(), edgecolor='none')     # save as file (800x600)
-        self.client.publish(self.settings["topics"]["livepath"], bytearray(buffer.getbuffer()), retain=True)
-        buffer.close()
-        plt.close('all')     
+    def renderFrame(self, snapshot, draw=False, stream=False, stream_snapshot=False, coverage=False):
+        """render and publish a snapshot of the path (runs on the render worker)"""
+        if coverage:
+            # only the new positions are converted, so an update never touches the whole mission
+            first = self.coverage.count
+            self.coverage.update(snapshot["xy"][first:] * 11.8, snapshot["t"][first:])  # convert to mm
+            self.client.publish(self.settings["coverage"]["topic"], json.dumps(self.coverage.stats()))
+        if stream:
+            self.publishStream(snapshot, stream_snapshot)
+        if draw and len(snapshot["xy"]) > 2:
+            # the tiles only change with new positions
+            if self.drawPath(snapshot) and self.tiles:
+                self.drawTiles(snapshot)
+
+    def resetRendering(self):
+        """start a new path in all renderers (runs on the render worker)"""
+        self.renderer.reset()
+        self.outputs.reset()
+        self.last_drawn = 0
+        if self.coverage:
+            self.coverage.reset()
+        if self.simplifier:
+            self.simplifier.reset()
+        if self.stream:
+            self.stream.reset()
+            self.publishStream(SampleBuffer(("theta",)).snapshot(), snapshot=True)
+        if self.tiles:
+            self.clearTiles()
+
+    def publishStats(self, stats):
+        self.debug("Render stats: {}".format(stats), 3)
+        if self.settings["topics"].get("renderstats"):
+            self.client.publish(self.settings["topics"]["renderstats"], json.dumps(stats))
+
+    def drawPath(self, snapshot):
+        """render and publish the path; returns False if there were no new positions"""
+        if len(snapshot["xy"]) == self.last_drawn and self.outputs.last:
+            # nothing new (e.g. requested frame while paused)
+            for topic, data in self.outputs.last.items():
+                self.client.publish(topic, data, retain=True)
+            return False
+        self.last_drawn = len(snapshot["xy"])
+        points = snapshot["xy"] * 11.8  # convert to mm
+        final = None
+        if self.simplifier:
+            self.simplifier.add(points[self.simplifier.count:])
+            points = self.simplifier.vertices()
+            # the last vertex moves on with the next positions
+            final = self.simplifier.final()
+        for topic, data in self.outputs.encode(self.renderer.render(points, final)).items():
+            self.client.publish(topic, data, retain=True)
+        return True
+
+    def drawTiles(self, snapshot):
+        """publish the changed tiles (retained, <topic>/<tx>_<ty>) and the manifest (<topic>/manifest)"""
+        points = snapshot["xy"] * 11.8  # convert to mm
+        topic = self.settings["tiles"]["topic"]
+        for (tx, ty), png in self.tiles.update(points).items():
+            self.client.publish("{}/{}_{}".format(topic, tx, ty), png, retain=True)
+        self.client.publish(topic + "/manifest", json.dumps(self.tiles.manifest(points[-1].tolist())), retain=True)
+
+    def clearTiles(self):
+        """remove the retained tiles of the last mission"""
+        topic = self.settings["tiles"]["topic"]
+        for tile in self.tiles.versions:
+            self.client.publish("{}/{}_{}".format(topic, *tile), b"", retain=True)
+        self.tiles.reset()
+        self.client.publish(topic + "/manifest", json.dumps(self.tiles.manifest()), retain=True)
+
+    def publishStream(self, path, snapshot=False):
+        """publish the new positions as batch (<topic>/batch) and, if requested, the whole path (<topic>/snapshot, retained)"""
+        topic = self.settings["stream"]["topic"]
+        points, values = path["xy"], path["theta"]
+        batch = self.stream.batch(points, values)
+        if batch:
+            self.client.publish(topic + "/batch", batch)
+        if snapshot:
+            self.client.publish(topic + "/snapshot", self.stream.snapshot(points, values), retain=True)
 
     def loop(self):
-        """main loop"""
-        while True:
-            time.sleep(5)
+        """main loop: waits for new positions (or frame requests) and hands frames to the render worker.
+        Frames are rendered only if there are new positions, at an interval that adapts to the pose rate and the
+        render time; the path stream is sent every second. A paused or idle robot causes no work at all."""
+        options = {"min_interval": 1, "max_interval": 10, "poses_per_frame": 5, "max_load": .2}
+        options.update(self.settings.get("render", {}))
+        on_demand = bool(self.settings["topics"].get("livepath_request"))
+        mission = self.mission
+        drawn = streamed = covered = 0
+        last_frame = last_stream = last_snapshot = last_coverage = time.monotonic()
+        interval = options["min_interval"]
+        pose_rate = None
 
-            # update livepath
-            if self.roomba_active and len(self.path)>2:
-                self.drawPath()
+        while True:
+            # sleep until something changed or a pending frame is due
+            now = time.monotonic()
+            count = len(self.path)
+            deadlines = []
+            if self.roomba_active and self.stream and count > streamed:
+                deadlines.append(last_stream + 1)
+            # a frame needs at least 3 positions; with fewer, wait for the next position instead of spinning
+            if self.roomba_active and not on_demand and count > 2 and count > drawn:
+                deadlines.append(last_frame + interval)
+            if self.roomba_active and self.coverage and count > covered:
+                deadlines.append(last_coverage + self.settings["coverage"]["interval"])
+            timeout = max(0, min(deadlines) - now) if deadlines else None
+            if self.changed.wait(timeout):
+                self.changed.clear()
+
+            now = time.monotonic()
+            if mission != self.mission:
+                # new mission
+                mission = self.mission
+                drawn = streamed = covered = 0
+                pose_rate = None
+            snapshot = self.path.snapshot()
+            count = len(snapshot["xy"])
+
+            requested, self.requested = self.requested, False
+            draw = count > 2 and (requested or (self.roomba_active and not on_demand and count > drawn and now >= last_frame + interval))
+            stream = bool(self.stream) and self.roomba_active and count > streamed and now >= last_stream + 1
+            coverage = bool(self.coverage) and self.roomba_active and count > covered and now >= last_coverage + self.settings["coverage"]["interval"]
+            if not (draw or stream or coverage):
+                continue
+
+            stream_snapshot = stream and now - last_snapshot >= self.settings["stream"]["snapshot_interval"]
+            self.worker.submit("frame", snapshot, draw=draw, stream=stream, stream_snapshot=stream_snapshot, coverage=coverage)
+            if coverage:
+                covered = count
+                last_coverage = now
+            if stream:
+                streamed = count
+                last_stream = now
+            if stream_snapshot:
+                last_snapshot = now
+            if draw:
+                # next interval: a few new positions per frame, but keep the render load low
+                if count > drawn and now > last_frame:
+                    rate = (count - drawn) / (now - last_frame)
+                    pose_rate = rate if pose_rate is None else .8 * pose_rate + .2 * rate
+                interval = max(options["poses_per_frame"] / pose_rate if pose_rate else 0, self.worker.render_time / options["max_load"])
+                interval = min(max(interval, options["min_interval"]), options["max_interval"])
+                drawn = count
+                last_frame = now
 
 
 if __name__ == '__main__':
@@ -1,15 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Render recorded missions as images.
+
+    python3 offlinepath.py 2018-08-05_191829_path.npz --show
+    python3 offlinepath.py /data/roomba "/data/archive/2019-*_path.npz" --output-dir /data/images --workers 8
+
+Missions can be in any format supported by common/missions.py. Every image is written next to its mission
+(<mission>.png) or into the output directory. Files are rendered headless (Agg) in a process pool; a mission is
+skipped if its image is newer and was rendered with the same parameters (stored in the PNG, see params_digest()).
+Change STYLE_VERSION together with the style to render everything again.
+"""
+
+import os
 import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-from matplotlib import ticker, pyplot as plt
+from PIL import Image
+from matplotlib import ticker
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from missions import load_mission, find_missions
+from simplify import rdp
 
 # width of vacuum opening
 ROOMBA_WIDTH = 180
 SCALING_FACTOR = 10
 
+# increase on every change of the rendering, so existing images are rendered again
+STYLE_VERSION = 1
+PARAMS_KEY = "render-params"
+
 class data_linewidth_plot():
     """ from https://stackoverflow.com/questions/19394505/matplotlib-expand-the-line-with-specified-width-in-data-unit#42972469 """
     def __init__(self, x, y, **kwargs):
-        self.ax = kwargs.pop("ax", plt.gca())
+        self.ax = kwargs.pop("ax")
         self.fig = self.ax.get_figure()
         self.lw_data = kwargs.pop("linewidth", 1)
         self.lw = 1
@@ -45,21 +77,15 @@ class data_linewidth_plot():
             self.timer.start()
 
 
-if len(sys.argv) > 1:
-    npzfile = np.load(sys.argv[1])
-
-    points = npzfile["points"][:] * 11.8  # convert to mm
-    values = npzfile["values"][:]
-
+def plot_mission(fig, points, resizable=False):
+    """plots the path (points in mm) onto the figure; resizable=True keeps the path width when the window is resized"""
     minx=np.amin(points, axis=0)[0]
     maxx=np.amax(points, axis=0)[0]
 
     miny=np.amin(points, axis=0)[1]
     maxy=np.amax(points, axis=0)[1]
 
-    fig = plt.figure(figsize=(10,8), dpi=100)
-    ax = plt.Axes(fig, [0., 0., 1., 1.])
-    fig.add_axes(ax)    
+    ax = fig.add_axes([0., 0., 1., 1.])
 
     #ax.set_title(u"Floor map", fontsize=20)
 
@@ -86,33 +112,128 @@ if len(sys.argv) > 1:
     ax.spines['bottom'].set_visible(False)
     ax.spines['left'].set_visible(False)
 
-    plt.tick_params(top=False, bottom=False, left=False, right=False, labelleft=False, labelbottom=False)
+    ax.tick_params(top=False, bottom=False, left=False, right=False, labelleft=False, labelbottom=False)
 
     # call this before any transformations. reason is unknown
-    fig.canvas.draw()   
-
+    fig.canvas.draw()
 
     # plot robot path with respect to width of vacuum unit (e.g. 180mm)
-    # from https://stackoverflow.com/questions/19394505/matplotlib-expand-the-line-with-specified-width-in-data-unit#42972469 
-    # if you want to updated lines (e.g. resize plot) take the full code from that answer 
-
-    # simple
-    #lw = ((ax.transData.transform((0, ROOMBA_WIDTH))-ax.transData.transform((0, 0)))*(72./fig.dpi))[1]
-    #plt.plot(points[:,0], points[:,1], '-', color="steelblue", linewidth=lw, alpha=.9, solid_capstyle="butt")
-
-    # full
-    data_linewidth_plot(points[:,0], points[:,1], ax=ax, color="steelblue", linewidth=ROOMBA_WIDTH, alpha=.9, solid_capstyle="butt")
-
+    # from https://stackoverflow.com/questions/19394505/matplotlib-expand-the-line-with-specified-width-in-data-unit#42972469
+    if resizable:
+        data_linewidth_plot(points[:,0], points[:,1], ax=ax, color="steelblue", linewidth=ROOMBA_WIDTH, alpha=.9, solid_capstyle="butt")
+    else:
+        # the figure size is fixed, so the width in points is computed once
+        lw = ((ax.transData.transform((0, ROOMBA_WIDTH))-ax.transData.transform((0, 0)))*(72./fig.dpi))[1]
+        ax.plot(points[:,0], points[:,1], '-', color="steelblue", linewidth=lw, alpha=.9, solid_capstyle="butt")
 
     # plot path (and position samples)
-    plt.plot(points[:,0], points[:,1], '-', color="white", markersize=2, linewidth=.75, alpha=.5)
+    ax.plot(points[:,0], points[:,1], '-', color="white", markersize=2, linewidth=.75, alpha=.5)
 
-    # plot start and end position 
-    start_pos = plt.Circle((points[0,0], points[0,1]), 100, color='white', linewidth=2, alpha=.5, zorder=100)
+    # plot start and end position
+    start_pos = Circle((points[0,0], points[0,1]), 100, color='white', linewidth=2, alpha=.5, zorder=100)
     ax.add_artist(start_pos)
 
-    final_pos = plt.Circle((points[-1,0], points[-1,1]), 100, color='lime', linewidth=2, alpha=.5, zorder=101)
+    final_pos = Circle((points[-1,0], points[-1,1]), 100, color='lime', linewidth=2, alpha=.5, zorder=101)
     ax.add_artist(final_pos)
-
-    plt.savefig(sys.argv[1]+".png", format="png", dpi=100, facecolor=fig.get_facecolor(), edgecolor='none')     # save as file (800x600)
-    plt.show()
+    return ax
+
+
+def load_points(filename, tolerance=None):
+    """returns the positions of a mission in mm, simplified with tolerance [mm] if given"""
+    points = load_mission(filename).points()
+    if tolerance:
+        points = rdp(points, tolerance)
+    return points
+
+
+def params_digest(size, dpi, tolerance):
+    """returns a short hash of everything that changes the image"""
+    params = {"style": STYLE_VERSION, "size": list(size), "dpi": dpi, "tolerance": tolerance}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def output_name(filename, directory=None):
+    """returns the image filename of a mission: next to it or in directory"""
+    if directory is None:
+        return filename + ".png"
+    return os.path.join(directory, os.path.basename(filename) + ".png")
+
+
+def up_to_date(filename, output, digest):
+    """True if output is newer than the mission and was rendered with the same parameters"""
+    try:
+        if os.path.getmtime(output) < os.path.getmtime(filename):
+            return False
+        with Image.open(output) as image:
+            return image.text.get(PARAMS_KEY) == digest
+    except (OSError, ValueError):
+        return False
+
+
+def render_mission(filename, output=None, size=(10, 8), dpi=100, tolerance=None):
+    """renders a mission headless into output (default: next to the mission) and returns its name"""
+    output = output or output_name(filename)
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    plot_mission(fig, load_points(filename, tolerance))
+    fig.savefig(output, format="png", dpi=dpi, facecolor=fig.get_facecolor(), edgecolor='none',
+                metadata={PARAMS_KEY: params_digest(size, dpi, tolerance)})
+    return output
+
+
+def render_job(job):
+    """renders one mission unless its image is up to date (runs in the process pool)"""
+    filename, output, size, dpi, tolerance, force = job
+    if not force and up_to_date(filename, output, params_digest(size, dpi, tolerance)):
+        return filename, None
+    try:
+        return filename, render_mission(filename, output, size, dpi, tolerance)
+    except Exception as e:
+        # a broken mission must not abort the whole batch (or the pool)
+        return filename, e
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="render roomba missions as images")
+    parser.add_argument("paths", nargs="+", help="mission files, directories or glob patterns")
+    parser.add_argument("--output-dir", help="write the images here instead of next to the missions")
+    parser.add_argument("--simplify", type=float, help="simplify the path, tolerance in mm (e.g. 5 for half a pixel at 10mm/pixel)")
+    parser.add_argument("--size", type=float, nargs=2, default=(10, 8), help="figure size in inches")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes rendering the files")
+    parser.add_argument("--force", action="store_true", help="render images that are up to date as well")
+    parser.add_argument("--show", action="store_true", help="show the mission in a window (single file)")
+    args = parser.parse_args()
+
+    missions = find_missions(args.paths)
+    if not missions:
+        sys.exit("no missions found in " + " ".join(args.paths))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.show:
+        from matplotlib import pyplot as plt
+        filename = missions[0]
+        fig = plt.figure(figsize=args.size, dpi=args.dpi)
+        plot_mission(fig, load_points(filename, args.simplify), resizable=True)
+        plt.savefig(output_name(filename, args.output_dir), format="png", dpi=args.dpi, facecolor=fig.get_facecolor(), edgecolor='none')
+        plt.show()
+        sys.exit()
+
+    jobs = [(filename, output_name(filename, args.output_dir), tuple(args.size), args.dpi, args.simplify, args.force)
+            for filename in missions]
+
+    rendered = skipped = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for filename, result in pool.map(render_job, jobs):
+            if result is None:
+                skipped += 1
+            elif isinstance(result, Exception):
+                print("{}: {}".format(filename, result))
+                failed += 1
+            else:
+                print(result)
+                rendered += 1
+    print("done: rendered {}, skipped {} up to date, {} failed".format(rendered, skipped, failed))
+    if failed:
+        sys.exit(1)
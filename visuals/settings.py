@@ -1,5 +1,12 @@
 settings = {
         "debug": 2, # 0=None, 1=Error, 2=Info, 3=Trace
+        "renderer": "matplotlib",   # livepath: matplotlib or raster (common/raster.py, much cheaper)
+        "scale": 10,    # mm per pixel of the raster renderer
+        "size": (1000, 800),    # pixels of the matplotlib renderer
+        "outputs": None,    # published images of the livepath, None: full size png on topics["livepath"]. e.g.
+                            # [{"topic": "home/roomba/state/livepath", "format": "png", "level": 6},
+                            #  {"topic": "home/roomba/state/livepath/thumb", "width": 200, "format": "jpeg", "quality": 70}]
+        "simplify": False,  # livepath: draw the path simplified to half a pixel at scale (common/simplify.py)
         "broker": {
             "host": "omv4.fritz.box",
             "port": 1883,
@@ -9,5 +16,29 @@ settings = {
             "signal": "home/roomba/state/signal",
             "status": "home/roomba/state/cleanMissionStatus",
             "livepath": "home/roomba/state/livepath",
+            "livepath_request": None,   # e.g. "home/roomba/cmd/livepath": render frames only when requested on this topic
+            "renderstats": None,    # e.g. "home/roomba/state/livepath/stats": queue and latency of the render worker (json)
+        },
+        "render": {     # livepath frames are rendered when there are new positions, at an adaptive interval
+            "min_interval": 1,  # [s]
+            "max_interval": 10, # [s]
+            "poses_per_frame": 5,   # wait for about this many new positions ...
+            "max_load": .2,     # ... but render at most this fraction of the time
+        },
+        "stream": {     # path as binary messages (see PathStream in livepath.py): <topic>/batch every second, <topic>/snapshot (retained)
+            "enabled": False,
+            "topic": "home/roomba/state/livepath/stream",
+            "snapshot_interval": 30,    # [s]
+        },
+        "coverage": {   # statistics of the running mission (json): covered area, distance, overlap, mean speed
+            "enabled": False,
+            "topic": "home/roomba/state/coverage",
+            "interval": 5,  # [s]
+            "cell": 20,     # mm per cell of the occupancy raster
+        },
+        "tiles": {  # tiled live map: <topic>/<tx>_<ty> (png, retained) and <topic>/manifest (json with tile versions)
+            "enabled": False,
+            "topic": "home/roomba/state/livemap",
+            "size": 2000,   # mm per tile (multiple of 500)
         },
     }
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import time
 from datetime import datetime, timedelta
 
@@ -23,6 +25,10 @@ import matplotlib.pyplot as plt
 
 from scipy.interpolate import griddata
 
+# shared modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from samples import SampleBuffer
+
 
 class WifiMap(object):
     def __init__(self, settings):
@@ -36,10 +42,8 @@ class WifiMap(object):
         self.roomba_active = False
         self.roomba_pos = None
         self.roomba_signal = None
-        self.points = []
-        self.values = []
-        self.path = []
-        self.heading = []
+        self.path = SampleBuffer(("theta",))
+        self.wifi = SampleBuffer(("rssi", "snr"))
 
         self.client.connect(self.settings["broker"]["host"], port=self.settings["broker"]["port"])
 
@@ -76,46 +80,47 @@ class WifiMap(object):
                 data = json.loads(msg.payload)
                 if "point" in data:
                     self.roomba_pos = data["point"]
-                    self.path.append( [data["point"]["x"], data["point"]["y"]])
-                if "theta" in data:
-                    self.heading.append(data["theta"])
+                    self.path.append(time.time(), data["point"]["x"], data["point"]["y"], theta=data.get("theta", np.nan))
 
             if msg.topic.startswith(self.settings["topics"]["signal"]) and self.roomba_active:
                 self.debug(str(msg.topic) + ': ' + str(msg.payload))
                 data = json.loads(msg.payload)
                 if "rssi" in data and self.roomba_pos:
-                    self.values.append(data["rssi"])
-                    self.points.append( [self.roomba_pos["x"], self.roomba_pos["y"]] )
+                    self.wifi.append(time.time(), self.roomba_pos["x"], self.roomba_pos["y"], rssi=data["rssi"], snr=data.get("snr", np.nan))
 
             if msg.topic.startswith(self.settings["topics"]["status"]):
                 self.debug(str(msg.topic) + ': ' + str(msg.payload))
                 data = json.loads(msg.payload)
                 if "phase" in data:
                     if self.roomba_active and (data["phase"] == "stop" or data["phase"] == "charge"):
-                        print("Captured values: ", len(self.points))
-                        if len(self.points) >= 4:
+                        print("Captured values: ", len(self.wifi))
+                        if len(self.wifi) >= 4:
                             
-                            self.points = np.array(self.points)
-                            minx=np.amin(self.points, axis=0)[0]
-                            maxx=np.amax(self.points, axis=0)[0]
+                            points = self.wifi.xy
+                            minx=np.amin(points, axis=0)[0]
+                            maxx=np.amax(points, axis=0)[0]
 
-                            miny=np.amin(self.points, axis=0)[1]
-                            maxy=np.amax(self.points, axis=0)[1]
+                            miny=np.amin(points, axis=0)[1]
+                            maxy=np.amax(points, axis=0)[1]
 
                             grid_x, grid_y = np.mgrid[minx:maxx:100j, miny:maxy:100j]
-                            raw = griddata(self.points, self.values, (grid_x, grid_y), method='linear')
+                            raw = griddata(points, self.wifi["rssi"], (grid_x, grid_y), method='linear')
 
                             #im = plt.imshow(raw, interpolation='lanczos', vmax=abs(raw).max(), vmin=-abs(raw).max())
                             plt.imshow(raw.T, origin='lower', extent=(minx,maxx,miny,maxy))
-                            plt.plot(self.points[:,0], self.points[:,1], 'k.', ms=5)
+                            plt.plot(points[:,0], points[:,1], 'k.', ms=5)
 
                             #plt.show()
                             plt.savefig("wifimap.png", dpi=150)     # save as file (800x600)
                             plt.close('all')     
 
                             temp_name = datetime.now().strftime("%Y-%m-%d_%H%M%S")
-                            np.savez(temp_name+"_wifi.npz", points=self.points, values=self.values)
-                            np.savez(temp_name+"_path.npz", points=self.path, values=self.heading)
+                            np.savez(temp_name+"_wifi.npz", points=self.wifi.xy, values=self.wifi["rssi"], t=self.wifi.t, snr=self.wifi["snr"])
+                            np.savez(temp_name+"_path.npz", points=self.path.xy, values=self.path["theta"], t=self.path.t)
+
+                        # delete captured data
+                        self.wifi.clear()
+                        self.path.clear()
 
                     self.roomba_active = (data["phase"] == "run") or (data["phase"] == "hmPostMsn")
 